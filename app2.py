@@ -1,20 +1,35 @@
 # --- Imports ---
 import streamlit as st
 import random
+from streamlit.errors import StreamlitAPIException
 from streamlit_folium import st_folium
 import folium
-from folium.plugins import Fullscreen
+from folium.plugins import Fullscreen, FastMarkerCluster, HeatMap
+from branca.element import MacroElement
+from jinja2 import Template
+import branca.colormap
 from geopy.geocoders import Nominatim
 from geopy.exc import GeocoderTimedOut
 import google.generativeai as genai
 import json
+import html
 import os
 import time
 import sqlite3
 import pandas as pd
+import numpy as np
 from datetime import datetime
 import io
+import csv
 import re # Added for robust geocoding
+import math
+import unicodedata
+import queue
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # Google Drive Imports
 try:
@@ -181,11 +196,154 @@ def login():
 # --- Database Functions ---
 DB_PATH = "real_estate.db"
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    # Create table with new schema if not exists
-    c.execute('''
+# Pragmas applied to every connection. WAL lets readers proceed while a write is in
+# progress; NORMAL sync is durable enough under WAL and avoids an fsync per commit.
+DB_PRAGMAS = {
+    "synchronous": "NORMAL",
+    "cache_size": -16000,      # ~16MB page cache per connection
+    "mmap_size": 268435456,    # 256MB memory-mapped I/O
+    "busy_timeout": 5000,      # ms to wait on a locked database instead of failing
+    "temp_store": "MEMORY",
+}
+
+class ConnectionManager:
+    """
+    Process-wide access to the SQLite ledger.
+    Writes go through a single connection guarded by a lock (SQLite allows one writer anyway).
+    Reads use a small pool of query-only connections, so under WAL they never wait for the writer.
+    """
+    def __init__(self, db_path, pool_size=4):
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self._write_lock = threading.Lock()
+        self._writer = self._connect()
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._readers = queue.LifoQueue()
+        # Change detection: _version counts our own commits, while PRAGMA data_version on a
+        # dedicated connection changes whenever any other connection (or process) commits.
+        self._version = 0
+        self._watch = self._connect(query_only=True)
+        self._watch_lock = threading.Lock()
+
+    def _connect(self, query_only=False):
+        # isolation_level=None: transactions are explicit (see write()), reads see the latest commit
+        conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False, isolation_level=None)
+        for name, value in DB_PRAGMAS.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        if query_only:
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    @contextmanager
+    def read(self):
+        """Borrow a pooled read-only connection."""
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = self._connect(query_only=True)
+        try:
+            yield conn
+        finally:
+            if self._readers.qsize() < self.pool_size:
+                self._readers.put(conn)
+            else:
+                conn.close()
+
+    @contextmanager
+    def snapshot(self):
+        """Read connection inside one transaction, so several queries see the same data."""
+        with self.read() as conn:
+            conn.execute("BEGIN")
+            try:
+                yield conn
+            finally:
+                conn.execute("COMMIT")
+
+    @contextmanager
+    def write(self):
+        """Run a block in one IMMEDIATE transaction on the shared writer connection."""
+        with self._write_lock:
+            conn = self._writer
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            else:
+                conn.execute("COMMIT")
+                self._version += 1
+
+    def data_version(self):
+        """Token that changes after any committed write, in this process or another one."""
+        with self._watch_lock:
+            pragma_version = self._watch.execute("PRAGMA data_version").fetchone()[0]
+        return (self._version, pragma_version)
+
+class LedgerCache:
+    """
+    In-memory copy of the properties table, kept current from the change log.
+    Unchanged data versions reuse the frame as is; otherwise only the rows listed by
+    changes_since() are re-read, with a full reload when the delta is large or the log was pruned.
+    """
+    # Above this many changed rows a full reload is cheaper than patching the frame
+    MAX_DELTA_ROWS = 500
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._version = None
+        self._seq = 0
+        self._df = None
+
+    def get(self):
+        version = self.db.data_version()
+        with self._lock:
+            if self._df is None or version != self._version:
+                with self.db.snapshot() as conn:
+                    delta = None if self._df is None else changes_since(self._seq, conn=conn)
+                    if delta is None or len(delta["changes"]) > self.MAX_DELTA_ROWS:
+                        self._reload(conn)
+                    else:
+                        self._apply(conn, delta)
+                self._version = version
+            # Callers add/convert columns in place, so hand out a copy
+            return self._df.copy()
+
+    def _reload(self, conn):
+        self._seq = latest_change_seq(conn)
+        self._df = pd.read_sql_query("SELECT * FROM properties ORDER BY created_at DESC", conn)
+
+    def _apply(self, conn, delta):
+        last_op = {}
+        for _, property_id, op in delta["changes"]:
+            last_op[property_id] = op
+        if last_op:
+            changed = list(last_op)
+            upserts = [pid for pid, op in last_op.items() if op != "D"]
+            df = self._df[~self._df["id"].isin(changed)]
+            if upserts:
+                rows = pd.read_sql_query(
+                    f"SELECT * FROM properties WHERE id IN ({', '.join('?' * len(upserts))})", conn, params=upserts
+                )
+                df = pd.concat([df, rows], ignore_index=True) if not df.empty else rows
+            self._df = df.sort_values("created_at", ascending=False, kind="stable").reset_index(drop=True)
+        self._seq = delta["last_seq"]
+
+# --- Schema Migrations ---
+# Ordered list of (version, migration). PRAGMA user_version stores the last applied
+# version, so each migration runs exactly once per database file.
+def _column_names(conn, table):
+    # table_xinfo also lists generated columns, which table_info hides
+    return {row[1] for row in conn.execute(f"PRAGMA table_xinfo({table})")}
+
+def _add_column_if_missing(conn, table, column, decl):
+    if column not in _column_names(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def _migration_base_schema(conn):
+    """properties table, including the columns older databases were created without."""
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS properties (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             title TEXT,
@@ -204,60 +362,720 @@ def init_db():
             legal_risks TEXT
         )
     ''')
-    
-    # Migration: Add columns if they don't exist (for existing DBs)
-    try: c.execute("ALTER TABLE properties ADD COLUMN renovation_cost INTEGER")
-    except sqlite3.OperationalError: pass
-    try: c.execute("ALTER TABLE properties ADD COLUMN roi REAL")
-    except sqlite3.OperationalError: pass
-    try: c.execute("ALTER TABLE properties ADD COLUMN details_json TEXT")
-    except sqlite3.OperationalError: pass
-    try: c.execute("ALTER TABLE properties ADD COLUMN legal_risks TEXT")
-    except sqlite3.OperationalError: pass
-    
-    conn.commit()
-    conn.close()
+    _add_column_if_missing(conn, "properties", "renovation_cost", "INTEGER")
+    _add_column_if_missing(conn, "properties", "roi", "REAL")
+    _add_column_if_missing(conn, "properties", "details_json", "TEXT")
+    _add_column_if_missing(conn, "properties", "legal_risks", "TEXT")
+
+def _migration_ledger_indexes(conn):
+    """Indexes backing the filtered / sorted ledger queries.
+    id is the rowid, so each index is already ordered by (column, id) as keyset pagination needs."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_properties_status ON properties(status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_properties_created_at ON properties(created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_properties_roi ON properties(roi)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_properties_price ON properties(price)")
+
+# Numeric analysis fields exposed from details_json as indexed generated columns.
+# Non-numeric text ("30万円") casts to its numeric prefix; malformed JSON yields NULL.
+def _details_number(key):
+    return (
+        f"CASE WHEN json_valid(details_json) "
+        f"THEN CAST(json_extract(details_json, '$.{key}') AS REAL) END"
+    )
+
+# pros / cons may be a string or a list; flatten either to " / "-joined text
+def _details_text(key, source="details_json"):
+    return (
+        f"CASE WHEN json_valid({source}) "
+        f"THEN (SELECT group_concat(value, ' / ') FROM json_each({source}, '$.{key}')) END"
+    )
+
+def _migration_details_columns(conn):
+    """Materialize the Gemini analysis fields so SQLite can sort and aggregate on them."""
+    _add_column_if_missing(
+        conn, "properties", "expected_revenue_monthly",
+        f"REAL GENERATED ALWAYS AS ({_details_number('expected_revenue_monthly')}) VIRTUAL",
+    )
+    # The prompt doesn't always return total_investment; fall back to price + renovation
+    _add_column_if_missing(
+        conn, "properties", "total_investment",
+        f"REAL GENERATED ALWAYS AS (COALESCE({_details_number('total_investment')}, "
+        f"COALESCE(price, 0) + COALESCE(renovation_cost, 0))) VIRTUAL",
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_properties_revenue ON properties(expected_revenue_monthly)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_properties_total_investment ON properties(total_investment)")
+
+    # Generated columns can't use subqueries, so the list fields are kept up to date by triggers
+    _add_column_if_missing(conn, "properties", "pros", "TEXT")
+    _add_column_if_missing(conn, "properties", "cons", "TEXT")
+    for name, event in (("properties_details_ai", "AFTER INSERT"), ("properties_details_au", "AFTER UPDATE OF details_json")):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name} {event} ON properties
+            BEGIN
+                UPDATE properties
+                SET pros = {_details_text('pros', 'NEW.details_json')},
+                    cons = {_details_text('cons', 'NEW.details_json')}
+                WHERE id = NEW.id;
+            END
+        ''')
+    conn.execute(f"UPDATE properties SET pros = {_details_text('pros')}, cons = {_details_text('cons')}")
+
+# Legacy rows may hold '' or other text in the REAL columns; SQLite compares those as != 0
+VALID_COORDS_SQL = (
+    "typeof({t}latitude) IN ('real', 'integer') AND {t}latitude != 0"
+    " AND typeof({t}longitude) IN ('real', 'integer') AND {t}longitude != 0"
+)
 
-def save_property(data):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO properties (
-            title, address, latitude, longitude, price, features, rating, memo, status, created_at,
-            renovation_cost, roi, details_json, legal_risks
+def _migration_spatial_index(conn):
+    """R*Tree over property coordinates, kept in sync with properties by triggers.
+    Rows without usable coordinates (NULL / 0 / text) are left out of the index."""
+    conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS properties_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)")
+    new_valid = VALID_COORDS_SQL.format(t="NEW.")
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS properties_rtree_ai AFTER INSERT ON properties
+        WHEN {new_valid}
+        BEGIN
+            INSERT INTO properties_rtree VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS properties_rtree_au AFTER UPDATE OF latitude, longitude ON properties
+        BEGIN
+            DELETE FROM properties_rtree WHERE id = OLD.id;
+            INSERT INTO properties_rtree
+            SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude WHERE {new_valid};
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS properties_rtree_ad AFTER DELETE ON properties
+        BEGIN
+            DELETE FROM properties_rtree WHERE id = OLD.id;
+        END
+    ''')
+    conn.execute(f'''
+        INSERT OR REPLACE INTO properties_rtree
+        SELECT id, latitude, latitude, longitude, longitude FROM properties WHERE {VALID_COORDS_SQL.format(t="")}
+    ''')
+
+FTS_COLUMNS = ("title", "address", "features", "memo", "legal_risks")
+
+def _migration_full_text_search(conn):
+    """FTS5 index (trigram tokenizer, which works for Japanese without word segmentation)
+    over the text columns, as an external-content table synced by triggers."""
+    cols = ", ".join(FTS_COLUMNS)
+    new_vals = ", ".join(f"NEW.{c}" for c in FTS_COLUMNS)
+    old_vals = ", ".join(f"OLD.{c}" for c in FTS_COLUMNS)
+    conn.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS properties_fts USING fts5(
+            {cols}, content='properties', content_rowid='id', tokenize='trigram'
         )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
+    """)
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS properties_fts_ai AFTER INSERT ON properties
+        BEGIN
+            INSERT INTO properties_fts(rowid, {cols}) VALUES (NEW.id, {new_vals});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS properties_fts_ad AFTER DELETE ON properties
+        BEGIN
+            INSERT INTO properties_fts(properties_fts, rowid, {cols}) VALUES ('delete', OLD.id, {old_vals});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS properties_fts_au AFTER UPDATE OF {cols} ON properties
+        BEGIN
+            INSERT INTO properties_fts(properties_fts, rowid, {cols}) VALUES ('delete', OLD.id, {old_vals});
+            INSERT INTO properties_fts(rowid, {cols}) VALUES (NEW.id, {new_vals});
+        END
+    ''')
+    conn.execute("INSERT INTO properties_fts(properties_fts) VALUES ('rebuild')")
+
+def _migration_change_log(conn):
+    """Append-only log of row-level changes to properties, written by triggers."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS property_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            property_id INTEGER NOT NULL,
+            op TEXT NOT NULL, -- 'I' insert / 'U' update / 'D' delete
+            changed_at TEXT NOT NULL DEFAULT (datetime('now', 'localtime'))
+        )
+    ''')
+    for op, event, row in (("I", "INSERT", "NEW"), ("U", "UPDATE", "NEW"), ("D", "DELETE", "OLD")):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS property_changes_{op.lower()} AFTER {event} ON properties
+            BEGIN
+                INSERT INTO property_changes (property_id, op) VALUES ({row}.id, '{op}');
+            END
+        ''')
+
+def _migration_geocode_status(conn):
+    """geocode_status: precision of the stored coordinates ('exact' / 'town' / 'city' / 'manual'),
+    or 'pending' for imported rows still waiting on the background geocoder."""
+    _add_column_if_missing(conn, "properties", "geocode_status", "TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_properties_geocode_status ON properties(geocode_status)")
+
+def _migration_geocode_cache(conn):
+    """Forward-geocode results shared by every session and kept across restarts."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS geocode_cache (
+            address_key TEXT PRIMARY KEY,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            precision TEXT NOT NULL,
+            fetched_at REAL NOT NULL -- unix time
+        ) WITHOUT ROWID
+    ''')
+
+def _migration_job_state(conn):
+    """Checkpoints for resumable background jobs."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS job_state (
+            name TEXT PRIMARY KEY,
+            status TEXT NOT NULL,           -- 'running' / 'paused' / 'done'
+            cursor INTEGER NOT NULL DEFAULT 0, -- last processed properties.id
+            total INTEGER NOT NULL DEFAULT 0,
+            processed INTEGER NOT NULL DEFAULT 0,
+            improved INTEGER NOT NULL DEFAULT 0,
+            started_at REAL,
+            updated_at REAL
+        )
+    ''')
+
+def _migration_reverse_geocode_cache(conn):
+    """Reverse-geocode results keyed by a quantized lat/lon grid cell (see REVERSE_GRID)."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS reverse_geocode_cache (
+            cell_lat INTEGER NOT NULL,
+            cell_lon INTEGER NOT NULL,
+            address TEXT NOT NULL,
+            fetched_at REAL NOT NULL, -- unix time
+            PRIMARY KEY (cell_lat, cell_lon)
+        ) WITHOUT ROWID
+    ''')
+
+def _migration_clear_text_coords(conn):
+    """NULL out non-numeric coordinates ('' from old imports) so every reader sees them as missing."""
+    for col in ("latitude", "longitude"):
+        conn.execute(f"UPDATE properties SET {col} = NULL WHERE typeof({col}) NOT IN ('real', 'integer', 'null')")
+
+# Columns the details triggers derive from details_json; writing them is not a change of its own
+DERIVED_COLUMNS = ("pros", "cons")
+
+def _sync_change_log_trigger(conn):
+    """
+    Make the change-log update trigger fire on every stored column of properties except
+    DERIVED_COLUMNS, so the details triggers' own UPDATE of pros / cons isn't logged as a second
+    change. migrate() calls this after every migration, so added columns are picked up.
+    """
+    current = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'property_changes_u'").fetchone()
+    if current is None:
+        return # Before the change log migration
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(properties)") if row[1] not in DERIVED_COLUMNS]
+    sql = (
+        f"CREATE TRIGGER property_changes_u AFTER UPDATE OF {', '.join(columns)} ON properties "
+        "BEGIN INSERT INTO property_changes (property_id, op) VALUES (NEW.id, 'U'); END"
+    )
+    if current[0] == sql:
+        return
+    conn.execute("DROP TRIGGER property_changes_u")
+    conn.execute(sql)
+
+def _migration_fts_vocab(conn):
+    """Term listing of the trigram index, used to expand two-character search terms (see search_properties)."""
+    conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS properties_fts_vocab USING fts5vocab(properties_fts, row)")
+
+def _migration_fts_field_end(conn):
+    """
+    Re-index full-text search over properties_fts_source, a view that appends a space to every
+    field, so a two-character term that ends a field (or is the whole field) still has an
+    indexed trigram starting with it. The content table is the view, so 'rebuild' and the
+    triggers' 'delete' see exactly the text that was indexed.
+    """
+    cols = ", ".join(FTS_COLUMNS)
+    ended = lambda row: ", ".join(f"{row}{c} || ' '" for c in FTS_COLUMNS)
+    for trigger in ("properties_fts_ai", "properties_fts_ad", "properties_fts_au"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP TABLE IF EXISTS properties_fts_vocab")
+    conn.execute("DROP TABLE IF EXISTS properties_fts")
+    conn.execute(f"""
+        CREATE VIEW IF NOT EXISTS properties_fts_source AS
+        SELECT id, {", ".join(f"{c} || ' ' AS {c}" for c in FTS_COLUMNS)} FROM properties
+    """)
+    conn.execute(f"""
+        CREATE VIRTUAL TABLE properties_fts USING fts5(
+            {cols}, content='properties_fts_source', content_rowid='id', tokenize='trigram'
+        )
+    """)
+    conn.execute(f'''
+        CREATE TRIGGER properties_fts_ai AFTER INSERT ON properties
+        BEGIN
+            INSERT INTO properties_fts(rowid, {cols}) VALUES (NEW.id, {ended("NEW.")});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER properties_fts_ad AFTER DELETE ON properties
+        BEGIN
+            INSERT INTO properties_fts(properties_fts, rowid, {cols}) VALUES ('delete', OLD.id, {ended("OLD.")});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER properties_fts_au AFTER UPDATE OF {cols} ON properties
+        BEGIN
+            INSERT INTO properties_fts(properties_fts, rowid, {cols}) VALUES ('delete', OLD.id, {ended("OLD.")});
+            INSERT INTO properties_fts(rowid, {cols}) VALUES (NEW.id, {ended("NEW.")});
+        END
+    ''')
+    conn.execute("INSERT INTO properties_fts(properties_fts) VALUES ('rebuild')")
+    _migration_fts_vocab(conn)
+
+def _migration_legacy_city_fallbacks(conn):
+    """Rows saved before geocode_status existed have it NULL; mark the ones still sitting on the
+    city-hall fallback as 'city', so the backfill picks them up."""
+    conn.execute(
+        "UPDATE properties SET geocode_status = 'city' WHERE geocode_status IS NULL AND latitude = ? AND longitude = ?",
+        KYOTANGO_CITY_HALL
+    )
+
+def _migration_job_generation(conn):
+    """job_state.generation: bumped by each new pass, so a batch still in flight from an earlier
+    pass can't checkpoint over the new one."""
+    _add_column_if_missing(conn, "job_state", "generation", "INTEGER NOT NULL DEFAULT 0")
+
+MIGRATIONS = [
+    (1, _migration_base_schema),
+    (2, _migration_ledger_indexes),
+    (3, _migration_details_columns),
+    (4, _migration_spatial_index),
+    (5, _migration_full_text_search),
+    (6, _migration_change_log),
+    (7, _migration_geocode_status),
+    (8, _migration_geocode_cache),
+    (9, _migration_job_state),
+    (10, _migration_reverse_geocode_cache),
+    (11, _migration_clear_text_coords),
+    (12, _sync_change_log_trigger),
+    (13, _migration_fts_vocab),
+    (14, _migration_fts_field_end),
+    (15, _migration_legacy_city_fallbacks),
+    (16, _migration_job_generation),
+]
+
+def migrate(db):
+    """Apply pending migrations, one transaction each. Returns the resulting schema version."""
+    with db.read() as conn:
+        current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        with db.write() as conn:
+            # Re-check under the write lock: another server process may have migrated meanwhile
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                continue
+            migration(conn)
+            _sync_change_log_trigger(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+        current = version
+    return current
+
+# --- Change Log ---
+# How many change-log rows to keep; consumers that fall further behind do a full reload
+CHANGE_LOG_RETENTION = 10000
+
+def latest_change_seq(conn):
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM property_changes").fetchone()[0]
+
+def changes_since(seq, conn=None):
+    """
+    Changes committed after `seq`, oldest first: {"changes": [(seq, property_id, op), ...], "last_seq": n}.
+    Returns None when entries after `seq` have been pruned and the caller must reload in full.
+    """
+    if conn is None:
+        with get_db().snapshot() as conn:
+            return changes_since(seq, conn)
+    oldest = conn.execute("SELECT MIN(seq) FROM property_changes").fetchone()[0]
+    if oldest is not None and seq < oldest - 1:
+        return None
+    changes = conn.execute(
+        "SELECT seq, property_id, op FROM property_changes WHERE seq > ? ORDER BY seq", (seq,)
+    ).fetchall()
+    return {"changes": changes, "last_seq": changes[-1][0] if changes else seq}
+
+def prune_change_log(db, keep=CHANGE_LOG_RETENTION):
+    with db.write() as conn:
+        conn.execute("DELETE FROM property_changes WHERE seq <= (SELECT MAX(seq) FROM property_changes) - ?", (keep,))
+
+@st.cache_resource
+def get_db():
+    """Shared ConnectionManager for all sessions and reruns. Migrates the schema on first use."""
+    db = ConnectionManager(DB_PATH)
+    migrate(db)
+    prune_change_log(db)
+    return db
+
+@st.cache_resource
+def get_ledger_cache():
+    return LedgerCache(get_db())
+
+PROPERTY_INSERT_SQL = '''
+    INSERT INTO properties (
+        title, address, latitude, longitude, price, features, rating, memo, status, created_at,
+        renovation_cost, roi, details_json, legal_risks, geocode_status
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def _property_row(data, created_at):
+    return (
         data['title'], data['address'], data['latitude'], data['longitude'], 
         data['price'], data['features'], data['rating'], data['memo'], 
-        data['status'], datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        data['status'], created_at,
         data.get('renovation_cost', 0), data.get('roi', 0.0), data.get('details_json', '{}'),
-        data.get('legal_risks', '')
-    ))
-    conn.commit()
-    new_id = c.lastrowid
-    conn.close()
+        data.get('legal_risks', ''), data.get('geocode_status')
+    )
+
+def save_property(data):
+    with get_db().write() as conn:
+        c = conn.cursor()
+        c.execute(PROPERTY_INSERT_SQL, _property_row(data, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        new_id = c.lastrowid
     return new_id
 
+# Columns that may be changed after creation. Field names are interpolated into SQL,
+# so anything outside this list is rejected.
+UPDATABLE_COLUMNS = (
+    "title", "address", "latitude", "longitude", "price", "features", "rating", "memo",
+    "status", "renovation_cost", "roi", "details_json", "legal_risks", "geocode_status",
+)
+
+def bulk_apply(ops, db=None):
+    """
+    Apply a batch of ("update", id, {field: value}) / ("delete", id) operations in one transaction.
+    Returns the number of operations applied.
+    """
+    with (db or get_db()).write() as conn:
+        return apply_ops(conn, ops)
+
+def apply_ops(conn, ops):
+    """
+    bulk_apply() inside a caller's write transaction.
+    Consecutive operations with the same SQL shape are sent as a single executemany.
+    """
+    batches = [] # [(sql, [params, ...]), ...] in submission order
+    for op in ops:
+        kind, prop_id = op[0], int(op[1])
+        if kind == "delete":
+            sql, params = "DELETE FROM properties WHERE id = ?", (prop_id,)
+        elif kind == "update":
+            fields = op[2]
+            unknown = set(fields) - set(UPDATABLE_COLUMNS)
+            if unknown:
+                raise ValueError(f"Column(s) not updatable: {', '.join(sorted(unknown))}")
+            if not fields:
+                continue
+            names = sorted(fields)
+            sql = f"UPDATE properties SET {', '.join(f'{name} = ?' for name in names)} WHERE id = ?"
+            params = tuple(fields[name] for name in names) + (prop_id,)
+        else:
+            raise ValueError(f"Unknown operation: {kind}")
+
+        if batches and batches[-1][0] == sql:
+            batches[-1][1].append(params)
+        else:
+            batches.append((sql, [params]))
+
+    for sql, rows in batches:
+        conn.executemany(sql, rows)
+    return sum(len(rows) for _, rows in batches)
+
+def update_properties(id, **fields):
+    """Update several columns of one property in a single statement."""
+    return bulk_apply([("update", id, fields)])
+
+def delete_properties(ids):
+    return bulk_apply([("delete", id) for id in ids])
+
 def delete_property(id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM properties WHERE id = ?", (id,))
-    conn.commit()
-    conn.close()
+    delete_properties([id])
 
 def update_property(id, field, value):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(f"UPDATE properties SET {field} = ? WHERE id = ?", (value, id))
-    conn.commit()
-    conn.close()
+    update_properties(id, **{field: value})
 
 def get_all_properties():
-    conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql_query("SELECT * FROM properties ORDER BY created_at DESC", conn)
-    conn.close()
-    return df
+    return get_ledger_cache().get()
+
+# --- Ledger Queries ---
+# Columns a view may project. Computed columns are evaluated in SQL.
+LEDGER_COLUMNS = (
+    "id", "title", "address", "latitude", "longitude", "price", "features", "rating", "memo",
+    "status", "created_at", "renovation_cost", "roi", "details_json", "legal_risks",
+    "expected_revenue_monthly", "total_investment", "pros", "cons", "geocode_status",
+)
+COMPUTED_COLUMNS = {
+    "total_price": "COALESCE(price, 0) + COALESCE(renovation_cost, 0)",
+}
+SORTABLE_COLUMNS = ("created_at", "price", "roi", "expected_revenue_monthly", "total_investment", "id")
+
+LIST_COLUMNS = ["id", "status", "title", "price", "renovation_cost", "total_price", "roi", "expected_revenue_monthly", "rating", "address", "latitude", "longitude"]
+MAP_COLUMNS = ["id", "title", "status", "price", "roi", "latitude", "longitude"]
+SELECTOR_COLUMNS = ["id", "title", "status"]
+
+def _ledger_filters(statuses=None, ratings=None, price_range=None, roi_range=None, valid_coords=False):
+    """Build the WHERE clause shared by query_properties() and count_properties()."""
+    clauses, params = [], []
+    if statuses:
+        clauses.append(f"status IN ({', '.join('?' * len(statuses))})")
+        params.extend(statuses)
+    if ratings:
+        clauses.append(f"rating IN ({', '.join('?' * len(ratings))})")
+        params.extend(ratings)
+    for column, bounds in (("price", price_range), ("roi", roi_range)):
+        if not bounds:
+            continue
+        low, high = bounds
+        if low is not None:
+            clauses.append(f"{column} >= ?")
+            params.append(low)
+        if high is not None:
+            clauses.append(f"{column} <= ?")
+            params.append(high)
+    if valid_coords:
+        clauses.append(VALID_COORDS_SQL.format(t=""))
+    return clauses, params
+
+def _keyset_clause(order_by, descending, after):
+    """
+    WHERE fragment selecting rows strictly after the cursor (sort_value, id).
+    SQLite sorts NULLs first ascending and last descending, so NULL sort values need their own branch.
+    """
+    value, last_id = after
+    if descending:
+        if value is None:
+            return f"({order_by} IS NULL AND id < ?)", [last_id]
+        return f"({order_by} < ? OR ({order_by} = ? AND id < ?) OR {order_by} IS NULL)", [value, value, last_id]
+    if value is None:
+        return f"(({order_by} IS NULL AND id > ?) OR {order_by} IS NOT NULL)", [last_id]
+    return f"({order_by} > ? OR ({order_by} = ? AND id > ?))", [value, value, last_id]
+
+def _select_list(columns):
+    columns = list(columns or LEDGER_COLUMNS)
+    for column in columns:
+        if column not in LEDGER_COLUMNS and column not in COMPUTED_COLUMNS:
+            raise ValueError(f"Unknown column: {column}")
+    return ", ".join(f"{COMPUTED_COLUMNS[c]} AS {c}" if c in COMPUTED_COLUMNS else c for c in columns)
+
+def query_properties(columns=None, statuses=None, ratings=None, price_range=None, roi_range=None,
+                     valid_coords=False, order_by="created_at", descending=True, limit=None, after=None):
+    """
+    Filtered, sorted and column-projected ledger query.
+    Paging is keyset-based: pass the returned cursor back as `after` to fetch the next page.
+    Returns (df, next_cursor); next_cursor is None on the last page.
+    """
+    if order_by not in SORTABLE_COLUMNS:
+        raise ValueError(f"Unsupported sort column: {order_by}")
+    columns = list(columns or LEDGER_COLUMNS)
+
+    # The cursor needs the sort key and id even when the view doesn't show them
+    select = list(dict.fromkeys(columns + [order_by, "id"]))
+    select_sql = _select_list(select)
+
+    clauses, params = _ledger_filters(statuses, ratings, price_range, roi_range, valid_coords)
+    if after is not None:
+        clause, clause_params = _keyset_clause(order_by, descending, after)
+        clauses.append(clause)
+        params.extend(clause_params)
+
+    direction = "DESC" if descending else "ASC"
+    sql = f"SELECT {select_sql} FROM properties"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += f" ORDER BY {order_by} {direction}, id {direction}"
+    if limit is not None:
+        # One extra row tells us whether another page exists
+        sql += " LIMIT ?"
+        params.append(limit + 1)
+
+    with get_db().read() as conn:
+        df = pd.read_sql_query(sql, conn, params=params)
+
+    next_cursor = None
+    if limit is not None and len(df) > limit:
+        df = df.iloc[:limit]
+        last = df.iloc[-1]
+        value = last[order_by]
+        if pd.isna(value):
+            value = None
+        elif hasattr(value, "item"):
+            value = value.item() # numpy scalar -> Python value sqlite3 can bind
+        next_cursor = (value, int(last["id"]))
+    return df[columns], next_cursor
+
+def count_properties(**filters):
+    clauses, params = _ledger_filters(**filters)
+    sql = "SELECT COUNT(*) FROM properties"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    with get_db().read() as conn:
+        return conn.execute(sql, params).fetchone()[0]
+
+def portfolio_totals(**filters):
+    """Portfolio aggregates computed in SQLite over the materialized analysis columns."""
+    clauses, params = _ledger_filters(**filters)
+    sql = '''
+        SELECT COUNT(*), SUM(total_investment), SUM(expected_revenue_monthly), AVG(roi)
+        FROM properties
+    '''
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    with get_db().read() as conn:
+        count, investment, revenue, avg_roi = conn.execute(sql, params).fetchone()
+    return {
+        "count": count,
+        "total_investment": investment or 0,
+        "expected_revenue_monthly": revenue or 0,
+        "avg_roi": avg_roi or 0,
+    }
+
+# --- Spatial Queries (R*Tree) ---
+def properties_in_bbox(min_lat, min_lon, max_lat, max_lon, columns=None, **filters):
+    """Properties inside a lat/lon box. The box is resolved by the R*Tree, not a table scan."""
+    clauses, params = _ledger_filters(**filters)
+    sql = f'''
+        SELECT {_select_list(columns)} FROM properties
+        WHERE id IN (
+            SELECT id FROM properties_rtree
+            WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?
+        )
+    '''
+    params = [min_lat, max_lat, min_lon, max_lon] + params
+    if clauses:
+        sql += " AND " + " AND ".join(clauses)
+    with get_db().read() as conn:
+        return pd.read_sql_query(sql, conn, params=params)
+
+def nearest_property(lat, lon, max_distance=0.01, columns=None):
+    """
+    Closest property to (lat, lon) within max_distance degrees, or None.
+    Probes the R*Tree with a growing box; once a candidate at distance d is found,
+    one more probe with a box of half-width d makes sure nothing closer sits just outside.
+    """
+    # Scale longitude so distances are roughly isotropic at Kyotango's latitude
+    kx = math.cos(math.radians(lat))
+    sql = f'''
+        SELECT {_select_list(columns)},
+               (latitude - ?) * (latitude - ?) + ((longitude - ?) * ?) * ((longitude - ?) * ?) AS _d2
+        FROM properties
+        WHERE id IN (
+            SELECT id FROM properties_rtree
+            WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?
+        )
+        ORDER BY _d2 LIMIT 1
+    '''
+
+    def probe(radius):
+        lon_radius = radius / kx
+        params = [lat, lat, lon, kx, lon, kx, lat - radius, lat + radius, lon - lon_radius, lon + lon_radius]
+        with get_db().read() as conn:
+            df = pd.read_sql_query(sql, conn, params=params)
+        return None if df.empty else df.iloc[0]
+
+    radius = min(0.0005, max_distance)
+    while True:
+        row = probe(radius)
+        if row is not None:
+            distance = math.sqrt(row["_d2"])
+            if distance > max_distance:
+                return None
+            if distance > radius:
+                row = probe(distance)
+            return row.drop("_d2")
+        if radius >= max_distance:
+            return None
+        radius = min(radius * 4, max_distance)
+
+# --- Full-Text Search (FTS5) ---
+SEARCH_COLUMNS = ["id", "status", "title", "address", "price", "roi"]
+
+def _fts_phrase(term):
+    # Quote so FTS5 query syntax characters are taken literally
+    return '"' + term.replace('"', '""') + '"'
+
+def search_properties(query, limit=20, columns=None):
+    """
+    Ranked keyword search over title, address, features, memo and legal_risks.
+    Terms of 3+ characters are answered by the trigram index (ranked by bm25).
+    Two-character terms (e.g. "網野") are expanded to the indexed trigrams that start with
+    them ("網野町", "網野駅", "網野 " at the end of a field), so they stay index lookups too.
+    Single characters fall back to LIKE, a scan of the ledger.
+    """
+    terms = query.split()
+    if not terms:
+        return pd.DataFrame(columns=columns or SEARCH_COLUMNS)
+    phrases, short_terms = [], []
+    with get_db().read() as conn:
+        for term in terms:
+            if len(term) >= 3:
+                phrases.append(_fts_phrase(term))
+            elif len(term) == 2:
+                prefix = term.lower() # The trigram tokenizer folds case
+                trigrams = [row[0] for row in conn.execute(
+                    "SELECT term FROM properties_fts_vocab WHERE term >= ? AND term < ?", (prefix, prefix + "\U0010ffff")
+                )]
+                if not trigrams:
+                    return pd.DataFrame(columns=columns or SEARCH_COLUMNS)
+                phrases.append("(" + " OR ".join(_fts_phrase(t) for t in trigrams) + ")")
+            else:
+                short_terms.append(term)
+
+    clauses, params = [], []
+    if phrases:
+        clauses.append("properties_fts MATCH ?")
+        params.append(" AND ".join(phrases))
+    for term in short_terms:
+        escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        clauses.append("(" + " OR ".join(f"{c} LIKE ? ESCAPE '\\'" for c in FTS_COLUMNS) + ")")
+        params.extend([f"%{escaped}%"] * len(FTS_COLUMNS))
+    order = "rank" if phrases else "rowid DESC"
+
+    sql = f'''
+        SELECT {_select_list(columns or SEARCH_COLUMNS)} FROM properties
+        JOIN (
+            SELECT rowid AS hit_id, ROW_NUMBER() OVER (ORDER BY {order}) AS hit_rank
+            FROM properties_fts WHERE {" AND ".join(clauses)}
+            ORDER BY {order} LIMIT ?
+        ) hits ON properties.id = hits.hit_id
+        ORDER BY hits.hit_rank
+    '''
+    params.append(limit)
+    with get_db().read() as conn:
+        return pd.read_sql_query(sql, conn, params=params)
+
+def portfolio_extent(**filters):
+    """(min_lat, min_lon, max_lat, max_lon, count) over properties with usable coordinates."""
+    clauses, params = _ledger_filters(valid_coords=True, **filters)
+    sql = "SELECT MIN(latitude), MIN(longitude), MAX(latitude), MAX(longitude), COUNT(*) FROM properties WHERE " + " AND ".join(clauses)
+    with get_db().read() as conn:
+        return conn.execute(sql, params).fetchone()
+
+def portfolio_points(**filters):
+    """
+    (lat, lon, roi, price, address) over properties with usable coordinates: float arrays
+    (NaN where unset) and the address strings.
+    """
+    clauses, params = _ledger_filters(valid_coords=True, **filters)
+    sql = "SELECT latitude, longitude, roi, price, address FROM properties WHERE " + " AND ".join(clauses)
+    with get_db().read() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    points = np.array([row[:4] for row in rows], dtype=float).reshape(-1, 4) # None -> NaN
+    return points[:, 0], points[:, 1], points[:, 2], points[:, 3], [row[4] for row in rows]
+
+def get_property(id):
+    """Single ledger row as a Series, or None if it no longer exists."""
+    with get_db().read() as conn:
+        df = pd.read_sql_query("SELECT * FROM properties WHERE id = ?", conn, params=(int(id),))
+    if df.empty:
+        return None
+    return df.iloc[0]
 
 # --- Google Drive Functions ---
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
@@ -417,58 +1235,1368 @@ def analyze_investment_value(api_key, address, audio_file=None, extra_files=None
     except Exception as e:
         return {"error": str(e)}
 
-def get_coords_from_address(address):
+# --- Address Normalization ---
+KYOTANGO_CITY_HALL = (35.62, 135.06)
+KYOTANGO_TOWNS = ("峰山町", "大宮町", "網野町", "丹後町", "弥栄町", "久美浜町")
+# Dash look-alikes seen between block numbers (after NFKC): hyphen, dashes, minus, long vowel mark
+_NUMBER_DASHES = "\u2010\u2011\u2012\u2013\u2014\u2015\u2212\u30fc"
+
+def normalize_address(address):
+    """
+    Canonical form of a Kyotango address, used as the geocode cache key and query.
+    Returns (canonical, town_key), e.g.
+    "京都府京丹後市 網野町網野１２３番地の４" -> ("網野町網野123-4", "網野町網野").
+    """
+    text = unicodedata.normalize("NFKC", address or "") # full-width digits / letters -> half-width
+    text = re.sub(r"\s+", "", text)
+    text = re.sub(r"^(京都府)?(京丹後市)?", "", text)
+    text = re.sub(r"(町)大?字", r"\1", text) # "網野町字網野" -> "網野町網野"
+    text = re.sub(rf"(?<=\d)[{_NUMBER_DASHES}](?=\d)", "-", text)
+    text = re.sub(r"(\d+)(丁目|番地|番)の?", r"\1-", text)
+    text = re.sub(r"(\d+)号", r"\1", text)
+    text = re.sub(r"(?<=\d)の(?=\d)", "-", text)
+    text = re.sub(r"-{2,}", "-", text).strip("-")
+
+    first_digit = re.search(r"\d", text)
+    town_key = text[:first_digit.start()] if first_digit else text
+    return text, town_key
+
+def geocode_query(normalized):
+    """Nominatim query string for a normalized address (prefecture / city prefix restored)."""
+    if normalized.startswith(KYOTANGO_TOWNS):
+        return f"京都府京丹後市{normalized}"
+    return f"京都府{normalized}"
+
+# --- Kyotango Gazetteer ---
+# Centroid (lat, lon) and bounding box (min_lat, min_lon, max_lat, max_lon) of Kyotango's six
+# towns and the 大字 we have positions for. Hand-placed from public web maps, not survey data:
+# centroids are within roughly 1 km and boxes are loose. Good enough for "town" precision and
+# for sanity checks on remote results; exact positions come from Nominatim or a map click.
+# For every 大字, point GAZETTEER_CSV at MLIT's 位置参照情報 (大字・町丁目レベル) CSV for
+# 京都府 (https://nlftp.mlit.go.jp/isj/); its representative points replace these entries.
+KYOTANGO_BBOX = (35.53, 134.83, 35.79, 135.21)
+KYOTANGO_GAZETTEER = {
+    # Towns (旧町)
+    "峰山町": ((35.625, 135.060), (35.585, 135.010, 35.665, 135.100)),
+    "大宮町": ((35.575, 135.105), (35.530, 135.060, 35.625, 135.165)),
+    "網野町": ((35.680, 135.010), (35.630, 134.930, 35.745, 135.070)),
+    "丹後町": ((35.735, 135.120), (35.690, 135.060, 35.790, 135.210)),
+    "弥栄町": ((35.675, 135.100), (35.630, 135.060, 35.720, 135.170)),
+    "久美浜町": ((35.605, 134.900), (35.530, 134.830, 35.670, 134.985)),
+    # 大字
+    "峰山町杉谷": ((35.624, 135.061), (35.615, 135.052, 35.633, 135.070)),
+    "峰山町吉原": ((35.618, 135.045), (35.609, 135.035, 35.627, 135.055)),
+    "峰山町丹波": ((35.612, 135.057), (35.603, 135.048, 35.621, 135.066)),
+    "峰山町新町": ((35.631, 135.062), (35.625, 135.055, 35.637, 135.069)),
+    "峰山町長岡": ((35.603, 135.035), (35.593, 135.024, 35.613, 135.046)),
+    "峰山町荒山": ((35.618, 135.072), (35.610, 135.064, 35.626, 135.080)),
+    "大宮町口大野": ((35.585, 135.097), (35.577, 135.088, 35.593, 135.106)),
+    "大宮町周枳": ((35.594, 135.085), (35.586, 135.076, 35.602, 135.094)),
+    "大宮町河辺": ((35.567, 135.115), (35.557, 135.104, 35.577, 135.126)),
+    "大宮町三坂": ((35.565, 135.100), (35.556, 135.091, 35.574, 135.109)),
+    "大宮町森本": ((35.601, 135.081), (35.594, 135.073, 35.608, 135.089)),
+    "網野町網野": ((35.684, 135.029), (35.676, 135.019, 35.692, 135.039)),
+    "網野町浅茂川": ((35.690, 135.020), (35.684, 135.012, 35.696, 135.028)),
+    "網野町島津": ((35.670, 135.005), (35.661, 134.995, 35.679, 135.015)),
+    "網野町木津": ((35.655, 134.985), (35.645, 134.972, 35.665, 134.998)),
+    "網野町浜詰": ((35.670, 134.960), (35.661, 134.948, 35.679, 134.972)),
+    "網野町掛津": ((35.695, 135.000), (35.688, 134.990, 35.702, 135.010)),
+    "網野町三津": ((35.728, 135.045), (35.720, 135.036, 35.736, 135.054)),
+    "丹後町間人": ((35.734, 135.094), (35.726, 135.084, 35.742, 135.104)),
+    "丹後町竹野": ((35.735, 135.125), (35.728, 135.116, 35.742, 135.134)),
+    "丹後町宮": ((35.722, 135.112), (35.715, 135.104, 35.729, 135.120)),
+    "丹後町中浜": ((35.752, 135.131), (35.745, 135.123, 35.759, 135.139)),
+    "丹後町袖志": ((35.770, 135.148), (35.763, 135.140, 35.777, 135.156)),
+    "弥栄町溝谷": ((35.667, 135.087), (35.659, 135.078, 35.675, 135.096)),
+    "弥栄町黒部": ((35.667, 135.103), (35.659, 135.095, 35.675, 135.111)),
+    "弥栄町船木": ((35.694, 135.100), (35.687, 135.092, 35.701, 135.108)),
+    "久美浜町湊宮": ((35.637, 134.912), (35.629, 134.902, 35.645, 134.922)),
+    "久美浜町浦明": ((35.617, 134.918), (35.610, 134.910, 35.624, 134.926)),
+    "久美浜町甲山": ((35.610, 134.935), (35.602, 134.926, 35.618, 134.944)),
+    "久美浜町葛野": ((35.640, 134.872), (35.632, 134.862, 35.648, 134.882)),
+}
+
+# All 大字 per town, from Japan Post's postal code data (KEN_ALL). Names not in the gazetteer
+# still resolve, at the town's centroid, with "town" precision.
+KYOTANGO_OAZA = {
+    "峰山町": ("橋木", "矢田", "内記", "荒山", "新町", "赤坂", "石丸", "丹波", "杉谷", "不断", "四軒", "吉原", "上", "織元", "室", "堺",
+        "古殿", "安", "呉服", "浪花", "白銀", "泉", "光明寺", "御旅", "千歳", "富貴屋", "菅", "長岡", "新治", "小西", "西山", "二箇", "五箇",
+        "鱒留", "久次"),
+    "大宮町": ("口大野", "河辺", "周枳", "善王寺", "久住", "五十河", "延利", "明田", "新宮", "森本", "三重", "三坂", "奥大野", "谷内", "上常吉",
+        "下常吉"),
+    "網野町": ("網野", "下岡", "磯", "浅茂川", "三津", "掛津", "小浜", "島津", "仲禅寺", "高橋", "公庄", "郷", "生野内", "切畑", "新庄", "木津",
+        "日和田", "溝野", "俵野", "浜詰", "塩江"),
+    "丹後町": ("間人", "砂方", "大山", "三宅", "吉永", "是安", "成願寺", "徳光", "竹野", "筆石", "矢畑", "岩木", "願興寺", "牧ノ谷", "家ノ谷",
+        "宮", "乗原", "此代", "平", "中野", "井上", "畑", "井谷", "鞍内", "遠下", "上野", "久僧", "中浜", "尾和", "袖志", "谷内", "上山",
+        "碇", "三山"),
+    "弥栄町": ("野中", "須川", "溝谷", "等楽寺", "堤", "芋野", "吉沢", "和田野", "木橋", "鳥取", "小田", "黒部", "船木", "井辺", "国久"),
+    "久美浜町": ("十楽", "仲町", "向町", "土居", "栄町", "東本町", "新橋", "新町", "西本町", "甲坂", "栃谷", "奥三谷", "口三谷", "三谷", "口馬地",
+        "奥馬地", "河梨", "神谷", "葛野", "河内", "箱石", "湊宮", "大向", "旭", "蒲井", "鹿野", "平田", "三分", "三原", "壱分", "大井", "関",
+        "浦明", "長柄", "神崎", "甲山", "海士", "西橋爪", "橋爪", "島", "品田", "友重", "坂井", "油池", "永留", "女布", "長野", "坂谷",
+        "円頓寺", "郷", "竹藤", "丸山", "谷", "野中", "佐野", "二俣", "尉ケ畑", "小桑", "安養寺", "新庄", "芦原", "新谷", "出角", "市場",
+        "金谷", "市野々", "布袋野", "畑", "須田"),
+}
+
+# Half-width (degrees) of the box put around a 位置参照情報 representative point
+OAZA_POINT_RADIUS = 0.005
+
+def load_oaza_points(path):
+    """
+    Gazetteer entries for Kyotango's 大字 from a 位置参照情報 大字・町丁目レベル CSV (Shift_JIS,
+    one representative point per 大字). Rows outside 京丹後市 or the six towns are skipped.
+    """
+    entries = {}
+    with open(path, encoding="cp932", newline="") as f:
+        for row in csv.DictReader(f):
+            name = row["大字町丁目名"]
+            if row["市区町村名"] != "京丹後市" or not name.startswith(KYOTANGO_TOWNS):
+                continue
+            lat, lon = float(row["緯度"]), float(row["経度"])
+            r = OAZA_POINT_RADIUS
+            entries[name] = ((lat, lon), (lat - r, lon - r, lat + r, lon + r))
+    return entries
+
+class Gazetteer:
+    """In-memory index over KYOTANGO_GAZETTEER."""
+    def __init__(self, entries, city_bbox):
+        self._entries = entries
+        self._max_name = max(len(name) for name in entries)
+        self._city_bbox = city_bbox
+        # Smallest boxes first, so locate() prefers a 大字 over its town
+        self._by_area = sorted(
+            entries.items(), key=lambda item: (item[1][1][2] - item[1][1][0]) * (item[1][1][3] - item[1][1][1])
+        )
+
+    def lookup(self, town_key):
+        """(name, lat, lon) of the longest gazetteer name that prefixes town_key, or None."""
+        for length in range(min(len(town_key), self._max_name), 0, -1):
+            entry = self._entries.get(town_key[:length])
+            if entry:
+                (lat, lon), _ = entry
+                return town_key[:length], lat, lon
+        return None
+
+    def locate(self, lat, lon):
+        """Name of the smallest gazetteer area containing the point, or None."""
+        for name, (_, (min_lat, min_lon, max_lat, max_lon)) in self._by_area:
+            if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon:
+                return name
+        return None
+
+    def in_city(self, lat, lon):
+        min_lat, min_lon, max_lat, max_lon = self._city_bbox
+        return min_lat <= lat <= max_lat and min_lon <= lon <= max_lon
+
+    def bbox(self, name):
+        """(min_lat, min_lon, max_lat, max_lon) of a gazetteer area."""
+        return self._entries[name][1]
+
+    def missing_oaza(self):
+        """大字 (per KYOTANGO_OAZA) without a position of their own; they geocode to their town."""
+        return [town + oaza for town, names in KYOTANGO_OAZA.items() for oaza in names if town + oaza not in self._entries]
+
+@st.cache_resource
+def get_gazetteer():
+    entries = dict(KYOTANGO_GAZETTEER)
+    path = get_setting("GAZETTEER_CSV")
+    if path:
+        entries.update(load_oaza_points(path))
+    return Gazetteer(entries, KYOTANGO_BBOX)
+
+# --- Geocode Cache ---
+GEOCODE_CACHE_TTL = 30 * 24 * 3600 # Addresses rarely move; refresh monthly
+GEOCODE_FALLBACK_TTL = 24 * 3600   # City-hall fallbacks are usually failed lookups; retry daily
+
+def geocode_cache_get(key, db=None):
+    """Cached (lat, lon, precision) for an address key, or None if missing / expired."""
+    with (db or get_db()).read() as conn:
+        row = conn.execute(
+            "SELECT latitude, longitude, precision, fetched_at FROM geocode_cache WHERE address_key = ?", (key,)
+        ).fetchone()
+    if row is None:
+        return None
+    lat, lon, precision, fetched_at = row
+    ttl = GEOCODE_FALLBACK_TTL if precision == "city" else GEOCODE_CACHE_TTL
+    if time.time() - fetched_at > ttl:
+        return None
+    return lat, lon, precision
+
+def geocode_cache_put(key, result, db=None):
+    lat, lon, precision = result
+    with (db or get_db()).write() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO geocode_cache (address_key, latitude, longitude, precision, fetched_at) VALUES (?, ?, ?, ?, ?)",
+            (key, lat, lon, precision, time.time())
+        )
+
+# Reverse lookups are cached per grid cell of 1/REVERSE_GRID degrees (~11 m N-S, ~9 m E-W here)
+REVERSE_GRID = 10000
+
+def _grid_cell(lat, lon):
+    return round(lat * REVERSE_GRID), round(lon * REVERSE_GRID)
+
+def reverse_cache_get(lat, lon, db=None):
+    """Cached address for the click's grid cell or, failing that, the nearest of its 8 neighbours."""
+    cell_lat, cell_lon = _grid_cell(lat, lon)
+    with (db or get_db()).read() as conn:
+        row = conn.execute(
+            "SELECT address FROM reverse_geocode_cache "
+            "WHERE cell_lat BETWEEN ? AND ? AND cell_lon BETWEEN ? AND ? AND fetched_at > ? "
+            "ORDER BY (cell_lat - ?) * (cell_lat - ?) + (cell_lon - ?) * (cell_lon - ?) LIMIT 1",
+            (cell_lat - 1, cell_lat + 1, cell_lon - 1, cell_lon + 1, time.time() - GEOCODE_CACHE_TTL,
+             cell_lat, cell_lat, cell_lon, cell_lon)
+        ).fetchone()
+    return row[0] if row else None
+
+def reverse_cache_put(lat, lon, address, db=None):
+    with (db or get_db()).write() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO reverse_geocode_cache (cell_lat, cell_lon, address, fetched_at) VALUES (?, ?, ?, ?)",
+            (*_grid_cell(lat, lon), address, time.time())
+        )
+
+# --- Geocoding Client ---
+class TokenBucket:
+    """Blocking token bucket: `rate` acquisitions per second on average, bursts up to `capacity`."""
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class GeocoderBusy(Exception):
+    """Too many distinct lookups are already queued; the caller should degrade instead of waiting."""
+
+class GeocodingClient:
+    """
+    Process-wide access to Nominatim.
+    - Every network request takes a token from one bucket (Nominatim allows 1 request/second).
+    - Concurrent lookups for the same key share one in-flight Future (single-flight).
+    - At most `max_pending` distinct lookups may be queued; beyond that submit() raises GeocoderBusy.
+    - A lookup every caller has abandon()ed is cancelled if it has not started yet.
+    """
+    def __init__(self, rate=1.0, max_pending=16, workers=2, domain="nominatim.openstreetmap.org", scheme="https"):
+        self.endpoint = f"{scheme}://{domain}"
+        self._geolocator = Nominatim(user_agent="kyotango_scouter", domain=domain, scheme=scheme)
+        self._bucket = TokenBucket(rate)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="geocode")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._inflight = {}
+        self._waiters = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args):
+        """Run fn(*args) on the pool, or join the call already in flight for `key`."""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self._waiters[key] += 1
+                return future
+            if not self._slots.acquire(blocking=False):
+                raise GeocoderBusy(key)
+            future = self._executor.submit(fn, *args)
+            self._inflight[key] = future
+            self._waiters[key] = 1
+        future.add_done_callback(lambda done: self._release(key, done))
+        return future
+
+    def abandon(self, future):
+        """The caller no longer needs `future`; cancel it if nobody else does and it is still queued."""
+        with self._lock:
+            key = next((k for k, f in self._inflight.items() if f is future), None)
+            if key is None:
+                return
+            self._waiters[key] -= 1
+            if self._waiters[key] > 0:
+                return
+            # Unlist it before cancelling, so a submit() for the same key starts a fresh lookup
+            # instead of joining one that is about to be cancelled
+            del self._inflight[key], self._waiters[key]
+        future.cancel() # Fails harmlessly once the lookup is running; _release() runs either way
+
+    def _release(self, key, future):
+        with self._lock:
+            # abandon() may have unlisted this future and a newer lookup taken over the key
+            if self._inflight.get(key) is future:
+                del self._inflight[key], self._waiters[key]
+        self._slots.release()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._inflight)
+
+    def geocode(self, query, timeout=10):
+        """Rate-limited forward lookup. Blocks the calling thread."""
+        self._bucket.acquire()
+        return self._geolocator.geocode(query, timeout=timeout)
+
+    def reverse(self, lat, lon, timeout=10):
+        """Rate-limited reverse lookup. Blocks the calling thread."""
+        self._bucket.acquire()
+        return self._geolocator.reverse((lat, lon), language='ja', timeout=timeout)
+
+def get_setting(name, default=None):
+    """Environment variable, else Streamlit secret, else default."""
+    if name in os.environ:
+        return os.environ[name]
     try:
-        # print(f"DEBUG: Geocoding address: {address}")
-        geolocator = Nominatim(user_agent="kyotango_scouter")
-        
-        # Strategy 1: Exact Search
+        return st.secrets.get(name, default)
+    except Exception: # No secrets.toml
+        return default
+
+def setting_enabled(name):
+    """True if a setting is on ("on" / "1" / "true"); off by default."""
+    return str(get_setting(name, "off")).lower() in ("on", "1", "true")
+
+@st.cache_resource
+def get_geocoding_client():
+    # Point NOMINATIM_DOMAIN / NOMINATIM_SCHEME at nominatim_stub.py (and raise NOMINATIM_RATE) for offline runs
+    return GeocodingClient(
+        rate=float(get_setting("NOMINATIM_RATE", 1.0)),
+        domain=get_setting("NOMINATIM_DOMAIN", "nominatim.openstreetmap.org"),
+        scheme=get_setting("NOMINATIM_SCHEME", "https"),
+    )
+
+# --- Geocoding Providers ---
+# Higher is better
+PRECISION_RANK = {"city": 0, "town": 1, "exact": 2, "manual": 3}
+
+class CacheProvider:
+    """geocode_cache / reverse_geocode_cache. A hit is the chain's own earlier answer, so it is final."""
+    name = "cache"
+    remote = False
+
+    def __init__(self, db=None):
+        self.db = db
+
+    def geocode(self, canonical, town_key):
+        return geocode_cache_get(canonical, self.db)
+
+    def reverse(self, lat, lon):
+        cached = reverse_cache_get(lat, lon, self.db)
+        return (cached, "exact") if cached else None
+
+    def remember_geocode(self, canonical, result):
+        geocode_cache_put(canonical, result, self.db)
+
+    def remember_reverse(self, lat, lon, result):
+        reverse_cache_put(lat, lon, result[0], self.db)
+
+class GazetteerProvider:
+    """Town (大字) centroids; the answer whenever the input names nothing finer than a town."""
+    name = "gazetteer"
+    remote = False
+
+    def __init__(self, gazetteer):
+        self.gazetteer = gazetteer
+
+    def geocode(self, canonical, town_key):
+        town_hit = self.gazetteer.lookup(town_key) if town_key else None
+        return (town_hit[1], town_hit[2], "town") if town_hit else None
+
+    def reverse(self, lat, lon):
+        name = self.gazetteer.locate(lat, lon)
+        return (f"京都府京丹後市{name}", "town") if name else None
+
+class NominatimProvider:
+    """Nominatim through the shared rate-limited GeocodingClient."""
+    name = "nominatim"
+    remote = True
+
+    def __init__(self, client, gazetteer):
+        self.client = client
+        self.gazetteer = gazetteer
+
+    def geocode(self, canonical, town_key):
+        if not canonical:
+            return None
+        location = self.client.geocode(geocode_query(canonical), timeout=10)
+        if not location:
+            return None
+        # Reject same-named places elsewhere when the address is a Kyotango one
+        if town_key and self.gazetteer.lookup(town_key) and not self.gazetteer.in_city(location.latitude, location.longitude):
+            return None
+        return location.latitude, location.longitude, "exact"
+
+    def reverse(self, lat, lon):
+        location = self.client.reverse(lat, lon, timeout=10)
+        return (_japanese_address(location.address), "exact") if location else None
+
+class ProviderStats:
+    """Call counts and recent latencies of one provider operation."""
+    WINDOW = 500
+
+    def __init__(self):
+        self.calls = self.hits = self.errors = 0
+        self.latencies = []
+
+    def record(self, seconds, hit, error):
+        self.calls += 1
+        self.hits += hit
+        self.errors += error
+        self.latencies.append(seconds)
+        if len(self.latencies) > self.WINDOW:
+            del self.latencies[0]
+
+    def summary(self):
+        ordered = sorted(self.latencies)
+        pct = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1) if ordered else None
+        return {"calls": self.calls, "hits": self.hits, "errors": self.errors,
+                "p50_ms": pct(0.5), "p95_ms": pct(0.95), "max_ms": pct(1.0)}
+
+class GeocoderChain:
+    """
+    Asks providers in order and stops at the first answer that is good enough: a cache hit,
+    an exact result, or a town result for input that names nothing finer than a town.
+    Otherwise the most precise answer seen wins. Answers reached with the remote providers
+    consulted are written back to the cache provider, unless a remote provider failed (timeout,
+    offline): a fallback then says nothing about the address and is not cached.
+    Latency is recorded per provider.
+    """
+    def __init__(self, providers):
+        self.providers = providers
+        self.cache = next((p for p in providers if isinstance(p, CacheProvider)), None)
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _call(self, provider, op, *args):
+        started = time.perf_counter()
+        result, error = None, False
         try:
-            search_query = address
-            if "京都" not in address:
-                search_query = f"京都府 {address}"
-            
-            location = geolocator.geocode(search_query, timeout=10)
-            if location: return location.latitude, location.longitude, "exact"
-        except Exception as e:
-            pass
-            # print(f"DEBUG: Strategy 1 failed: {e}")
+            result = getattr(provider, op)(*args)
+        except Exception:
+            error = True
+        with self._lock:
+            stats = self._stats.setdefault((provider.name, op), ProviderStats())
+            stats.record(time.perf_counter() - started, result is not None, error)
+        return result, error
+
+    def _resolve(self, op, args, good_enough, remote):
+        """
+        (result, provider, final, failed); result and provider are None if nobody answered,
+        failed is True if a remote provider raised instead of answering.
+        """
+        best, best_provider, failed = None, None, False
+        for provider in self.providers:
+            if provider.remote and not remote:
+                continue
+            result, error = self._call(provider, op, *args)
+            failed = failed or (error and provider.remote)
+            if result is None:
+                continue
+            if provider is self.cache or good_enough(result):
+                return result, provider, True, failed
+            if best is None or PRECISION_RANK[result[-1]] > PRECISION_RANK[best[-1]]:
+                best, best_provider = result, provider
+        return best, best_provider, False, failed
+
+    def _geocode_good_enough(self, canonical, town_key):
+        return lambda result: result[2] == "exact" or (result[2] == "town" and canonical == town_key)
+
+    def geocode_local(self, canonical, town_key):
+        """Final (lat, lon, precision) available without the network, or None."""
+        result, _, final, _ = self._resolve("geocode", (canonical, town_key), self._geocode_good_enough(canonical, town_key), False)
+        return result if final else None
+
+    def geocode(self, canonical, town_key, remote=True):
+        """(lat, lon, precision); falls back to Kyotango City Hall when no provider answers."""
+        result, provider, _, failed = self._resolve("geocode", (canonical, town_key), self._geocode_good_enough(canonical, town_key), remote)
+        if result is None:
+            result = (KYOTANGO_CITY_HALL[0], KYOTANGO_CITY_HALL[1], "city")
+        # Only cache what the remote providers actually answered, "not found" included
+        if remote and self.cache and provider is not self.cache and not failed:
+            self.cache.remember_geocode(canonical, result)
+        return result
+
+    def reverse_local(self, lat, lon):
+        result, _, final, _ = self._resolve("reverse", (lat, lon), lambda r: r[1] == "exact", False)
+        return result[0] if final else None
+
+    def reverse(self, lat, lon, remote=True):
+        """Address at (lat, lon), or None. Only exact (remote) answers are cached."""
+        result, provider, _, _ = self._resolve("reverse", (lat, lon), lambda r: r[1] == "exact", remote)
+        if result is None:
+            return None
+        if remote and self.cache and provider is not self.cache and result[1] == "exact":
+            self.cache.remember_reverse(lat, lon, result)
+        return result[0]
+
+    def stats(self):
+        with self._lock:
+            return [{"provider": name, "op": op, **stats.summary()} for (name, op), stats in self._stats.items()]
+
+GEOCODER_PROVIDERS = {
+    "cache": lambda: CacheProvider(get_db()),
+    "gazetteer": lambda: GazetteerProvider(get_gazetteer()),
+    "nominatim": lambda: NominatimProvider(get_geocoding_client(), get_gazetteer()),
+}
+
+@st.cache_resource
+def get_geocoder_chain():
+    # GEOCODER_PROVIDERS="cache,gazetteer" runs fully offline; order is significant
+    names = get_setting("GEOCODER_PROVIDERS", "cache,gazetteer,nominatim")
+    return GeocoderChain([GEOCODER_PROVIDERS[name.strip()]() for name in names.split(",") if name.strip()])
+
+def request_coords(address):
+    """get_coords_from_address() as a Future; settles immediately unless the network is needed."""
+    canonical, town_key = normalize_address(address)
+    chain = get_geocoder_chain()
+    future = Future()
+    settled = chain.geocode_local(canonical, town_key)
+    if settled:
+        future.set_result(settled)
+        return future
+    try:
+        return get_geocoding_client().submit(("coords", canonical), chain.geocode, canonical, town_key)
+    except GeocoderBusy:
+        future.set_result(chain.geocode(canonical, town_key, remote=False))
+        return future
 
-        # Strategy 2: Fallback (Remove numbers)
-        try:
-            # Regex to remove block/house numbers (e.g., "網野町網野123-4" -> "網野町網野")
-            town_address = re.sub(r'\d+.*$', '', address).strip()
-            if town_address and town_address != address:
-                # print(f"DEBUG: Fallback to town search: {town_address}")
-                search_query = town_address
-                if "京都" not in town_address:
-                    search_query = f"京都府 {town_address}"
-                
-                location = geolocator.geocode(search_query, timeout=10)
-                if location: return location.latitude, location.longitude, "town"
-        except Exception as e:
-            pass
-            # print(f"DEBUG: Strategy 2 failed: {e}")
-        
-        # Strategy 3: City Fallback (Kyotango City Hall)
-        # print("DEBUG: Fallback to City Hall")
-        return 35.62, 135.06, "city"
-        
-    except Exception as e:
-        # print(f"CRITICAL ERROR in get_coords_from_address: {e}")
-        return 35.62, 135.06, "city"
+def get_coords_from_address(address):
+    """
+    (lat, lon, precision) for an address.
+    Cache and gazetteer answers come back on the calling thread; the rest go through the geocoding
+    client's pool, where spelling variants (normalize_address) share a single in-flight lookup.
+    """
+    return request_coords(address).result()
+
+def request_address(lat, lon):
+    """
+    Future resolving to the address at (lat, lon), or None if it could not be determined.
+    Cache hits (same or neighbouring grid cell) complete immediately; misses run on the
+    geocoding client's pool so the UI thread never waits on Nominatim.
+    """
+    chain = get_geocoder_chain()
+    future = Future()
+    cached = chain.reverse_local(lat, lon)
+    if cached:
+        future.set_result(cached)
+        return future
+    try:
+        return get_geocoding_client().submit(("address", _grid_cell(lat, lon)), chain.reverse, lat, lon)
+    except GeocoderBusy:
+        future.set_result(chain.reverse(lat, lon, remote=False))
+        return future
+
+def _japanese_address(nominatim_address):
+    """"1, 網野, 網野町, 京丹後市, 京都府, 629-3101, 日本" -> "京都府京丹後市網野町網野1"."""
+    parts = [p.strip() for p in nominatim_address.split(",")]
+    parts = [p for p in parts if p and p != "日本" and not re.fullmatch(r"\d{3}-?\d{4}", p)]
+    return "".join(reversed(parts))
 
 def get_address_from_coords(lat, lon):
-    geolocator = Nominatim(user_agent="kyotango_scouter")
+    address = request_address(lat, lon).result()
+    return address or "住所を取得できませんでした"
+
+# --- Background Geocoding ---
+# Rows whose coordinates are worth another lookup: waiting, imprecise, or missing
+BACKFILL_CANDIDATE_SQL = (
+    "(geocode_status IN ('pending', 'town', 'city') OR NOT ("
+    + VALID_COORDS_SQL.format(t="") + "))"
+)
+
+class GeocodeWorker:
+    """
+    Background geocoding thread.
+    - Rows imported with geocode_status='pending' are resolved as soon as they appear.
+    - A backfill pass (start_backfill) walks every row with imprecise or missing coordinates
+      in id order. Its cursor is checkpointed in job_state in the same transaction as each
+      batch of updates, so a restarted server resumes exactly where it stopped.
+    Lookups go through the shared GeocodingClient (cache + rate limit) and yield to interactive ones.
+    """
+    JOB = "geocode_backfill"
+    BATCH_ROWS = 20
+    RATE_WINDOW = 120 # seconds of recent lookups that throughput() is measured over
+
+    def __init__(self, db, client):
+        self.db = db
+        self.client = client
+        self.resolved = 0
+        self.last_error = None
+        # (finished_at, seconds) per recent lookup; idle time between lookups is not counted
+        self._recent = []
+        self._recent_lock = threading.Lock()
+        self._backfill_active = self.job_state().get("status") == "running" # resume after restart
+        self._wake = threading.Event()
+        self._wake.set() # Pick up rows left pending by a previous run
+        self._thread = threading.Thread(target=self._run, name="geocode-worker", daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def pending_count(self):
+        with self.db.read() as conn:
+            return conn.execute("SELECT COUNT(*) FROM properties WHERE geocode_status = 'pending'").fetchone()[0]
+
+    def backfill_candidates(self):
+        with self.db.read() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM properties WHERE {BACKFILL_CANDIDATE_SQL}").fetchone()[0]
+
+    def job_state(self):
+        with self.db.read() as conn:
+            row = conn.execute(
+                "SELECT status, cursor, total, processed, improved, started_at, updated_at, generation FROM job_state WHERE name = ?",
+                (self.JOB,)
+            ).fetchone()
+        if row is None:
+            return {}
+        return dict(zip(("status", "cursor", "total", "processed", "improved", "started_at", "updated_at", "generation"), row))
+
+    def throughput(self):
+        """Rows per second over this process's lookups in the last RATE_WINDOW seconds, or None if there were none."""
+        with self._recent_lock:
+            self._expire_recent(time.time())
+            busy = sum(seconds for _, seconds in self._recent)
+            return len(self._recent) / max(busy, 1e-6) if self._recent else None
+
+    def _expire_recent(self, now):
+        while self._recent and self._recent[0][0] < now - self.RATE_WINDOW:
+            del self._recent[0]
+
+    def start_backfill(self):
+        """Start a new pass over all candidate rows from the beginning."""
+        now = time.time()
+        with self.db.write() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM properties WHERE {BACKFILL_CANDIDATE_SQL}").fetchone()[0]
+            conn.execute(
+                "INSERT OR REPLACE INTO job_state (name, status, cursor, total, processed, improved, started_at, updated_at, generation) "
+                "VALUES (?, 'running', 0, ?, 0, 0, ?, ?, COALESCE((SELECT generation FROM job_state WHERE name = ?), 0) + 1)",
+                (self.JOB, total, now, now, self.JOB)
+            )
+        self._backfill_active = True
+        self.wake()
+
+    def pause_backfill(self):
+        self._set_status("paused")
+        self._backfill_active = False
+
+    def resume_backfill(self):
+        self._set_status("running")
+        self._backfill_active = True
+        self.wake()
+
+    def _set_status(self, status):
+        with self.db.write() as conn:
+            conn.execute("UPDATE job_state SET status = ?, updated_at = ? WHERE name = ?", (status, time.time(), self.JOB))
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=60)
+            self._wake.clear()
+            try:
+                while self._drain_pending():
+                    pass
+                while self._backfill_active and self._backfill_batch():
+                    pass
+            except Exception as e:
+                self.last_error = str(e)
+
+    def _lookup(self, rows):
+        """Geocode (id, address, status, lat, lon) rows; returns update ops for improved rows."""
+        ops = []
+        for prop_id, address, status, lat, lon in rows:
+            started = time.time()
+            # Let users' own lookups go first; they share the same 1 request/second budget
+            while self.client.in_flight():
+                time.sleep(0.2)
+            new_lat, new_lon, precision = get_coords_from_address(address or "")
+            has_coords = lat not in (None, 0) and lon not in (None, 0)
+            if status == "pending" or not has_coords or PRECISION_RANK[precision] > PRECISION_RANK.get(status, -1):
+                ops.append(("update", prop_id, {"latitude": new_lat, "longitude": new_lon, "geocode_status": precision}))
+            finished = time.time()
+            with self._recent_lock:
+                self._recent.append((finished, finished - started))
+                self._expire_recent(finished)
+        return ops
+
+    def _drain_pending(self):
+        with self.db.read() as conn:
+            rows = conn.execute(
+                "SELECT id, address, geocode_status, latitude, longitude FROM properties "
+                "WHERE geocode_status = 'pending' ORDER BY id LIMIT ?",
+                (self.BATCH_ROWS,)
+            ).fetchall()
+        if not rows:
+            return False
+        bulk_apply(self._lookup(rows), db=self.db)
+        self.resolved += len(rows)
+        return True
+
+    def _backfill_batch(self):
+        state = self.job_state()
+        if state.get("status") != "running":
+            self._backfill_active = False
+            return False
+        with self.db.read() as conn:
+            rows = conn.execute(
+                "SELECT id, address, geocode_status, latitude, longitude FROM properties "
+                f"WHERE id > ? AND {BACKFILL_CANDIDATE_SQL} ORDER BY id LIMIT ?",
+                (state["cursor"], self.BATCH_ROWS)
+            ).fetchall()
+        if not rows:
+            self._set_status("done")
+            self._backfill_active = False
+            return False
+        ops = self._lookup(rows)
+        with self.db.write() as conn:
+            apply_ops(conn, ops)
+            conn.execute(
+                "UPDATE job_state SET cursor = ?, processed = processed + ?, improved = improved + ?, updated_at = ? "
+                "WHERE name = ? AND status = 'running' AND generation = ?",
+                (rows[-1][0], len(rows), len(ops), time.time(), self.JOB, state["generation"])
+            )
+        self.resolved += len(rows)
+        return True
+
+@st.cache_resource
+def get_geocode_worker():
+    return GeocodeWorker(get_db(), get_geocoding_client())
+
+# --- Bulk Import ---
+# Header names accepted in listing sheets, per ledger column
+IMPORT_COLUMN_ALIASES = {
+    "title": ("title", "物件名", "名称", "タイトル"),
+    "address": ("address", "住所", "所在地"),
+    "price": ("price", "価格", "売出価格", "価格(万円)"),
+    "latitude": ("latitude", "lat", "緯度"),
+    "longitude": ("longitude", "lon", "lng", "経度"),
+    "features": ("features", "特徴", "備考"),
+    "rating": ("rating", "評価"),
+    "memo": ("memo", "メモ"),
+    "status": ("status", "ステータス"),
+    "renovation_cost": ("renovation_cost", "リノベ費用", "リフォーム費用"),
+    "roi": ("roi", "利回り", "表面利回り"),
+    "legal_risks": ("legal_risks", "法的リスク"),
+}
+IMPORT_CHUNK_ROWS = 500
+
+def _read_listing_chunks(file, chunk_rows):
+    """Yield DataFrames of at most chunk_rows rows from an uploaded CSV / Excel sheet."""
+    name = getattr(file, "name", "").lower()
+    if name.endswith((".xlsx", ".xls")):
+        # pandas can't stream Excel; read the sheet once and slice it
+        sheet = pd.read_excel(file)
+        for start in range(0, len(sheet), chunk_rows):
+            yield sheet.iloc[start:start + chunk_rows]
+        return
+    raw = file.getvalue()
     try:
-        location = geolocator.reverse((lat, lon), language='ja', timeout=10)
-        if location: return location.address
-        return "住所不明"
-    except: return "住所を取得できませんでした"
+        text = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        text = raw.decode("cp932") # Shift_JIS exports from Excel / listing portals
+    yield from pd.read_csv(io.StringIO(text), chunksize=chunk_rows)
+
+def _listing_rows(chunk, created_at):
+    """Map a sheet chunk onto PROPERTY_INSERT_SQL parameter tuples."""
+    headers = {str(h).strip(): h for h in chunk.columns}
+    column_of = {}
+    for field, aliases in IMPORT_COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in headers:
+                column_of[field] = headers[alias]
+                break
+    if "address" not in column_of:
+        raise ValueError("住所 (address) 列が見つかりません")
+
+    def values(field, numeric=False):
+        if field not in column_of:
+            return [None] * len(chunk)
+        series = chunk[column_of[field]]
+        series = pd.to_numeric(series, errors="coerce") if numeric else series.astype("string").str.strip()
+        return [None if pd.isna(v) else v for v in series.tolist()]
+
+    rows = []
+    fields = zip(
+        values("title"), values("address"), values("latitude", True), values("longitude", True),
+        values("price", True), values("features"), values("rating"), values("memo"), values("status"),
+        values("renovation_cost", True), values("roi", True), values("legal_risks"),
+    )
+    for title, address, lat, lon, price, features, rating, memo, status, renovation, roi, legal in fields:
+        if not address:
+            continue
+        has_coords = lat not in (None, 0) and lon not in (None, 0)
+        rows.append(_property_row({
+            "title": title or f"{address} の物件",
+            "address": address,
+            "latitude": lat if has_coords else None,
+            "longitude": lon if has_coords else None,
+            "price": int(price) if price is not None else 0,
+            "features": features or "",
+            "rating": rating or "-",
+            "memo": memo or "",
+            "status": status or "未内見",
+            "renovation_cost": int(renovation) if renovation is not None else 0,
+            "roi": roi if roi is not None else 0.0,
+            "legal_risks": legal or "",
+            # Rows without coordinates are geocoded later by the background worker
+            "geocode_status": "manual" if has_coords else "pending",
+        }, created_at))
+    return rows
+
+def import_listings(file, chunk_rows=IMPORT_CHUNK_ROWS):
+    """
+    Import a CSV / XLSX listing sheet. The sheet is streamed in chunks and all rows are
+    inserted in one transaction with executemany; geocoding is left to GeocodeWorker.
+    Returns the number of imported rows.
+    """
+    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    imported = 0
+    with get_db().write() as conn:
+        for chunk in _read_listing_chunks(file, chunk_rows):
+            rows = _listing_rows(chunk, created_at)
+            conn.executemany(PROPERTY_INSERT_SQL, rows)
+            imported += len(rows)
+    get_geocode_worker().wake()
+    return imported
+
+
+# --- Tile Cache ---
+# Base map sources: upstream URL template, attribution, folium built-in name (used when the
+# tile cache is off), how long a cached tile is served before re-fetching, and whether the
+# bbox may be pre-seeded. OSM's tile usage policy forbids bulk downloading, so OSM tiles are
+# only cached as they are viewed.
+TILE_SOURCES = {
+    "esri": {
+        "url": "https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}",
+        "attr": "Esri", "builtin": "Esri.WorldImagery", "max_age": 90 * 24 * 3600, "seedable": True,
+    },
+    "carto": {
+        "url": "https://a.basemaps.cartocdn.com/light_all/{z}/{x}/{y}.png",
+        "attr": "&copy; OpenStreetMap contributors &copy; CARTO", "builtin": "CartoDB positron",
+        "max_age": 30 * 24 * 3600, "seedable": True,
+    },
+    "osm": {
+        "url": "https://tile.openstreetmap.org/{z}/{x}/{y}.png",
+        "attr": "&copy; OpenStreetMap contributors", "builtin": "OpenStreetMap",
+        "max_age": 7 * 24 * 3600, "seedable": False,
+    },
+}
+TILE_DIR = "data/tiles"
+TILE_EXTENSIONS = {"esri": "jpg", "carto": "png", "osm": "png"}
+TILE_USER_AGENT = "kyotango_scouter (tile cache)"
+
+class TileStore:
+    """
+    One MBTiles file per source (data/tiles/<source>.mbtiles). Rows use the MBTiles TMS
+    y axis; get()/put() take the XYZ coordinates Leaflet requests. `fetched_at` is an extra
+    column, which MBTiles readers ignore.
+    """
+    def __init__(self, source, directory=TILE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.source = source
+        self.path = os.path.join(directory, f"{source}.mbtiles")
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS tiles (
+                zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB,
+                fetched_at REAL,
+                PRIMARY KEY (zoom_level, tile_column, tile_row)
+            ) WITHOUT ROWID
+        ''')
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO metadata (name, value) VALUES (?, ?)",
+            [("name", source), ("format", "jpg" if source == "esri" else "png"), ("attribution", TILE_SOURCES[source]["attr"])]
+        )
+        self._lock = threading.Lock()
+
+    def get(self, z, x, y):
+        """(tile bytes, fetched_at) or None."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT tile_data, fetched_at FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (z, x, (1 << z) - 1 - y)
+            ).fetchone()
+
+    def put(self, z, x, y, data):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                (z, x, (1 << z) - 1 - y, data, time.time())
+            )
 
+    def stats(self):
+        with self._lock:
+            count, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(tile_data)), 0) FROM tiles").fetchone()
+        return count, size
+
+def tile_xy(lat, lon, zoom):
+    """XYZ (x, y) of the tile containing (lat, lon) at `zoom`."""
+    n = 1 << zoom
+    x = min(n - 1, int((lon + 180) / 360 * n))
+    y = min(n - 1, int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n))
+    return x, y
+
+def tiles_in_bbox(bbox, zoom):
+    """XYZ (x, y) of every tile covering bbox (min_lat, min_lon, max_lat, max_lon) at `zoom`."""
+    min_lat, min_lon, max_lat, max_lon = bbox
+    (min_x, min_y), (max_x, max_y) = tile_xy(max_lat, min_lon, zoom), tile_xy(min_lat, max_lon, zoom)
+    return [(x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+
+def viewport_tiles(lat, lon, zoom, cols=3, rows=2):
+    """XYZ (x, y) of the tiles around (lat, lon): `cols` either side and `rows` above and below."""
+    n = 1 << zoom
+    cx, cy = tile_xy(lat, lon, zoom)
+    return [(x, y) for x in range(max(0, cx - cols), min(n, cx + cols + 1)) for y in range(max(0, cy - rows), min(n, cy + rows + 1))]
+
+class TileCache:
+    """
+    Read-through cache in front of the tile providers. Misses and expired tiles are fetched
+    upstream (rate-limited per source, with a burst allowance so a cold viewport loads at once);
+    when upstream is unreachable a stale tile is still served, so previously viewed or seeded
+    areas keep working offline.
+    Leaflet reaches the tiles in one of two ways:
+    - static_dir: tiles are published as files under Streamlit's static folder and load from
+      the app's own origin, wherever the browser is. Tiles not published yet fall back to the
+      provider in the browser; prefetch() publishes the viewport for the next render.
+    - port: a small HTTP server answers /<source>/<z>/<x>/<y>, at `public_url` (localhost, or
+      wherever a reverse proxy exposes it).
+    """
+    def __init__(self, port=None, host="127.0.0.1", public_url=None, static_dir=None, rate=4.0, burst=32):
+        self.stores = {source: TileStore(source) for source in TILE_SOURCES}
+        self._buckets = {source: TokenBucket(rate, capacity=burst) for source in TILE_SOURCES}
+        self.static_dir = static_dir
+        self.public_url = (public_url or f"http://localhost:{port}").rstrip("/")
+        self.hits = self.misses = self.stale = self.errors = 0
+        self.seeding = None # Progress dict of the running seed job, if any
+        self._prefetcher = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tile-prefetch")
+        self._prefetching = set()
+        self._prefetch_lock = threading.Lock()
+        if static_dir:
+            return
+        cache = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parts = self.path.split("?")[0].strip("/").split("/")
+                try:
+                    source, z, x, y = parts[0], int(parts[1]), int(parts[2]), int(parts[3].split(".")[0])
+                    tile = cache.tile(source, z, x, y)
+                except (IndexError, ValueError, KeyError):
+                    self.send_error(404)
+                    return
+                if tile is None:
+                    self.send_error(502, "tile unavailable")
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg" if source == "esri" else "image/png")
+                self.send_header("Content-Length", str(len(tile)))
+                self.send_header("Cache-Control", "max-age=86400")
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                self.wfile.write(tile)
+
+            def log_message(self, format, *args):
+                pass
+        self._server = ThreadingHTTPServer((host, port), Handler) # OSError if the port is taken
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="tile-cache", daemon=True).start()
+
+    def url_template(self, source):
+        return f"{self.public_url}/{source}/{{z}}/{{x}}/{{y}}.{TILE_EXTENSIONS[source]}"
+
+    def _fetch(self, source, z, x, y):
+        self._buckets[source].acquire()
+        url = TILE_SOURCES[source]["url"].format(z=z, x=x, y=y)
+        request = urllib.request.Request(url, headers={"User-Agent": TILE_USER_AGENT})
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.read()
+
+    def _static_path(self, source, z, x, y):
+        return os.path.join(self.static_dir, source, str(z), str(x), f"{y}.{TILE_EXTENSIONS[source]}")
+
+    def _publish(self, source, z, x, y, data):
+        """Write the tile where Streamlit serves it (static mode only)."""
+        if not self.static_dir:
+            return
+        path = self._static_path(source, z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.{threading.get_ident()}.part"
+        with open(partial, "wb") as f:
+            f.write(data)
+        os.replace(partial, path) # Never serve a half-written tile
+
+    def tile(self, source, z, x, y):
+        """Tile bytes from the store, refreshed from upstream when missing or expired; None if unavailable."""
+        store = self.stores[source] # KeyError for unknown sources
+        cached = store.get(z, x, y)
+        if cached and time.time() - cached[1] < TILE_SOURCES[source]["max_age"]:
+            self.hits += 1
+            return cached[0]
+        try:
+            data = self._fetch(source, z, x, y)
+        except Exception:
+            if cached:
+                self.stale += 1
+                return cached[0]
+            self.errors += 1
+            return None
+        self.misses += 1
+        store.put(z, x, y, data)
+        self._publish(source, z, x, y, data)
+        return data
+
+    def prefetch(self, source, lat, lon, zoom):
+        """Warm (and in static mode publish) the tiles around a map's view on background threads."""
+        for x, y in viewport_tiles(lat, lon, zoom):
+            key = (source, zoom, x, y)
+            with self._prefetch_lock:
+                if key in self._prefetching:
+                    continue
+                self._prefetching.add(key)
+            self._prefetcher.submit(self._prefetch_one, key)
+
+    def _prefetch_one(self, key):
+        source, z, x, y = key
+        try:
+            published = self.static_dir and os.path.exists(self._static_path(source, z, x, y))
+            cached = self.stores[source].get(z, x, y)
+            fresh = cached and time.time() - cached[1] < TILE_SOURCES[source]["max_age"]
+            if fresh and not published:
+                self._publish(source, z, x, y, cached[0])
+            elif not fresh:
+                self.tile(source, z, x, y)
+        finally:
+            with self._prefetch_lock:
+                self._prefetching.discard(key)
+
+    def seed(self, source, bbox, zooms, rate=2.0):
+        """Download every missing tile of `bbox` at `zooms` on a background thread (resumable: present tiles are skipped)."""
+        if not TILE_SOURCES[source]["seedable"]:
+            raise ValueError(f"{source} tiles may not be bulk-downloaded")
+        if self.seeding and self.seeding["running"]:
+            raise RuntimeError("seeding is already running")
+        todo = [(z, x, y) for z in zooms for x, y in tiles_in_bbox(bbox, z)]
+        progress = {"source": source, "total": len(todo), "done": 0, "fetched": 0, "errors": 0, "running": True, "cancel": False}
+        self.seeding = progress
+        bucket = TokenBucket(rate)
+        store = self.stores[source]
+        def run():
+            for z, x, y in todo:
+                if progress["cancel"]:
+                    break
+                if store.get(z, x, y) is None:
+                    bucket.acquire()
+                    try:
+                        data = self._fetch(source, z, x, y)
+                        store.put(z, x, y, data)
+                        self._publish(source, z, x, y, data)
+                        progress["fetched"] += 1
+                    except Exception:
+                        progress["errors"] += 1
+                progress["done"] += 1
+            progress["running"] = False
+        threading.Thread(target=run, name="tile-seed", daemon=True).start()
+        return progress
+
+# Streamlit serves <app dir>/static/ at /app/static/ when server.enableStaticServing is on
+TILE_STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "tiles")
+
+def _static_tiles_url():
+    base = (st.get_option("server.baseUrlPath") or "").strip("/")
+    return f"/{base}/app/static/tiles" if base else "/app/static/tiles"
+
+@st.cache_resource
+def get_tile_cache():
+    """
+    The tile cache, or None unless TILE_CACHE=on (env or secrets).
+    With TILE_CACHE_URL set, tiles are served from a local port that the URL reaches (e.g. through
+    a reverse proxy). Otherwise, with Streamlit static serving enabled (.streamlit/config.toml),
+    they are published as static files, which works from any browser. Failing both, the port
+    is only reachable from a browser on this machine.
+    None as well if the port cannot be bound (e.g. another server process already holds it);
+    maps then use the built-in providers and the sidebar shows a warning.
+    """
+    if not setting_enabled("TILE_CACHE"):
+        return None
+    # TILE_CACHE_RATE / TILE_CACHE_BURST: upstream requests per second per source, and how many
+    # may go out at once (a cold viewport needs ~35 tiles)
+    limits = {"rate": float(get_setting("TILE_CACHE_RATE", 4.0)), "burst": int(get_setting("TILE_CACHE_BURST", 32))}
+    public_url = get_setting("TILE_CACHE_URL")
+    if not public_url and st.get_option("server.enableStaticServing"):
+        return TileCache(static_dir=TILE_STATIC_DIR, public_url=_static_tiles_url(), **limits)
+    port = int(get_setting("TILE_CACHE_PORT", 8765))
+    # TILE_CACHE_HOST: set to 0.0.0.0 only if other machines must reach the port directly (it has no auth)
+    try:
+        return TileCache(port, host=get_setting("TILE_CACHE_HOST", "127.0.0.1"), public_url=public_url, **limits)
+    except OSError:
+        return None
+
+class _TileFallback(MacroElement):
+    """Loads a tile from the provider itself when the cache has not published it (yet)."""
+    _template = Template('''
+        {% macro script(this, kwargs) %}
+            {{ this._parent.get_name() }}.on("tileerror", function (e) {
+                var src = L.Util.template({{ this.url|tojson }}, e.coords);
+                if (e.tile.src !== src) { e.tile.src = src; }
+            });
+        {% endmacro %}
+    ''')
+
+    def __init__(self, url):
+        super().__init__()
+        self._name = "TileFallback"
+        self.url = url
+
+def tile_layer(source, name, show=True):
+    """TileLayer for a base map source, served through the tile cache when it is enabled."""
+    cache = get_tile_cache()
+    spec = TILE_SOURCES[source]
+    if cache is None:
+        return folium.TileLayer(spec["builtin"], name=name, attr=spec["attr"], show=show)
+    layer = folium.TileLayer(cache.url_template(source), name=name, attr=spec["attr"], show=show, max_zoom=19)
+    if cache.static_dir:
+        _TileFallback(spec["url"]).add_to(layer)
+    return layer
+
+# --- Portfolio Aggregates ---
+HEATMAP_CELL = 0.005 # degrees (~500 m); the heatmap draws one weighted point per occupied cell
+HEATMAP_METRICS = {"件数": "count", "平均利回り": "mean_roi", "平均価格": "mean_price"}
+
+def _binned_mean(lat, lon, values, bins, extent):
+    """Per-cell mean of `values` (NaN where a cell has no value)."""
+    has_value = ~np.isnan(values)
+    count, _, _ = np.histogram2d(lat[has_value], lon[has_value], bins=bins, range=extent)
+    total, _, _ = np.histogram2d(lat[has_value], lon[has_value], bins=bins, range=extent, weights=values[has_value])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return total / count
+
+def density_grid(lat, lon, roi, price, cell=HEATMAP_CELL, bbox=KYOTANGO_BBOX):
+    """
+    Occupied cells of a fixed grid over the city: centre, property count, mean ROI and mean price.
+    Binned with np.histogram2d, so cost is one pass over the points however many there are.
+    """
+    min_lat, min_lon, max_lat, max_lon = bbox
+    bins = (math.ceil((max_lat - min_lat) / cell), math.ceil((max_lon - min_lon) / cell))
+    extent = [[min_lat, min_lat + bins[0] * cell], [min_lon, min_lon + bins[1] * cell]]
+    count, lat_edges, lon_edges = np.histogram2d(lat, lon, bins=bins, range=extent)
+    mean_roi = _binned_mean(lat, lon, roi, bins, extent)
+    mean_price = _binned_mean(lat, lon, price, bins, extent)
+    rows, cols = np.nonzero(count)
+    return pd.DataFrame({
+        "lat": lat_edges[rows] + cell / 2,
+        "lon": lon_edges[cols] + cell / 2,
+        "count": count[rows, cols],
+        "mean_roi": mean_roi[rows, cols],
+        "mean_price": mean_price[rows, cols],
+    })
+
+def town_of_address(address):
+    """The town (旧町) an address names, e.g. "京丹後市大宮町周枳1" -> "大宮町", or None."""
+    canonical, _ = normalize_address(address)
+    return next((town for town in KYOTANGO_TOWNS if canonical.startswith(town)), None)
+
+def town_aggregates(lat, lon, roi, price, addresses, gazetteer):
+    """
+    Count, mean ROI / price and share of ROI >= 10% per town (旧町).
+    A property's town is the one its address names. Only addresses without a town fall back to
+    the gazetteer boxes, which overlap at the edges; the smallest box containing the point wins.
+    """
+    def box_area(town):
+        min_lat, min_lon, max_lat, max_lon = gazetteer.bbox(town)
+        return (max_lat - min_lat) * (max_lon - min_lon)
+    towns = sorted(KYOTANGO_TOWNS, key=box_area)
+    town_of = np.array([towns.index(town) if town else -1 for town in map(town_of_address, addresses)], dtype=int)
+    for index, town in enumerate(towns):
+        min_lat, min_lon, max_lat, max_lon = gazetteer.bbox(town)
+        inside = (town_of == -1) & (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+        town_of[inside] = index
+    areas = []
+    for index, town in enumerate(towns):
+        mask = town_of == index
+        if not mask.any():
+            continue
+        town_roi, town_price = roi[mask], price[mask]
+        areas.append({
+            "エリア": town,
+            "件数": int(mask.sum()),
+            "平均利回り(%)": float(np.nanmean(town_roi)) if (~np.isnan(town_roi)).any() else None,
+            "平均価格(万円)": float(np.nanmean(town_price)) if (~np.isnan(town_price)).any() else None,
+            "利回り10%以上": float((town_roi >= 10).sum() / mask.sum()),
+            "bbox": gazetteer.bbox(town),
+        })
+    return areas
+
+def portfolio_aggregates(**filters):
+    lat, lon, roi, price, addresses = portfolio_points(**filters)
+    return density_grid(lat, lon, roi, price), town_aggregates(lat, lon, roi, price, addresses, get_gazetteer())
+
+def add_heatmap_layer(layer, grid, metric):
+    """HeatMap over the precomputed grid cells, weighted by `metric` scaled to 0..1."""
+    values = grid[metric].to_numpy(dtype=float)
+    keep = ~np.isnan(values)
+    if not keep.any():
+        return
+    weights = values[keep] / (np.nanmax(values) or 1)
+    data = np.column_stack([grid["lat"].to_numpy()[keep], grid["lon"].to_numpy()[keep], weights]).round(5).tolist()
+    HeatMap(data, radius=25, blur=20, min_opacity=0.3, max_zoom=14).add_to(layer)
+
+def add_area_layer(layer, areas):
+    """One rectangle per town, colored by mean ROI, with the aggregates in its tooltip."""
+    rois = [a["平均利回り(%)"] for a in areas if a["平均利回り(%)"] is not None]
+    if not rois:
+        return
+    colormap = branca.colormap.linear.YlOrRd_09.scale(min(rois), max(rois) if max(rois) > min(rois) else min(rois) + 1)
+    for area in areas:
+        min_lat, min_lon, max_lat, max_lon = area["bbox"]
+        roi, price = area["平均利回り(%)"], area["平均価格(万円)"]
+        folium.Rectangle(
+            [[min_lat, min_lon], [max_lat, max_lon]],
+            color=colormap(roi) if roi is not None else "gray", weight=1,
+            fill=True, fill_opacity=0.35,
+            tooltip=(f"{area['エリア']}: {area['件数']}件 / 平均利回り {roi:.1f}% / 平均価格 {price:.0f}万円"
+                     if roi is not None and price is not None else f"{area['エリア']}: {area['件数']}件"),
+        ).add_to(layer)
+
+# --- Map Markers ---
+def _add_base_layers(m):
+    """Satellite / strategic / standard tile layers and their switcher."""
+    tile_layer("esri", '衛星写真 (Satellite)', show=True).add_to(m)
+    tile_layer("carto", '戦略マップ (Strategic)', show=False).add_to(m)
+    tile_layer("osm", '標準マップ (Standard)', show=False).add_to(m)
+    folium.LayerControl().add_to(m)
+    cache = get_tile_cache()
+    if cache is not None and m.location:
+        cache.prefetch("esri", m.location[0], m.location[1], m.options.get("zoom", 13)) # The layer shown first
+    return m
+
+def session_map_cache(name, signature, build):
+    """
+    build() once per `signature` (ledger data version + view parameters), kept in this session.
+    Used for the queries behind a map. The folium objects themselves are rebuilt every run:
+    st_folium mutates whatever it renders, so a reused Map or FeatureGroup emits stale JS.
+    Fresh builds serialize identically, so st_folium (stable key) does not remount them.
+    """
+    cache = st.session_state.setdefault("map_cache", {})
+    hit = cache.get(name)
+    if hit is not None and hit[0] == signature:
+        return hit[1]
+    value = build()
+    cache[name] = (signature, value)
+    return value
+
+# Marker color / icon per status
+STATUS_STYLES = {
+    "購入済み": ("red", "home"),
+    "検討中": ("blue", "info-sign"),
+    "見送り": ("black", "remove"),
+    "未内見": ("gray", "question"),
+}
+DEFAULT_STATUS_STYLE = ("orange", "star")
+# Above this many markers "自動" switches from individual pins to browser-side clustering
+MARKER_CLUSTER_THRESHOLD = 300
+
+def add_pin_markers(layer, df):
+    """One folium.Marker per row. Fine for small portfolios; build time and HTML grow per row."""
+    for row in df.itertuples(index=False):
+        color, icon_name = STATUS_STYLES.get(row.status, DEFAULT_STATUS_STYLE)
+        content = folium.Html(f"<b>{row.title}</b><br>価格: {row.price}万円<br>利回り: {row.roi}%", script=True)
+        content._id = f"popup_{row.id}" # Deterministic (not a random uuid), so unchanged markers serialize identically
+        popup = folium.Popup(content)
+        folium.Marker(
+            [row.latitude, row.longitude],
+            popup=popup,
+            tooltip=f"#{row.id} {row.title} ({row.status})",
+            icon=folium.Icon(color=color, icon=icon_name)
+        ).add_to(layer)
+
+# A single function expression (FastMarkerCluster emits `var callback = <this>;`) turning
+# one compact data row into a marker in the browser (see add_cluster_markers)
+_CLUSTER_CALLBACK = """(function () {
+    var styles = %s;
+    return function (row) {
+        var style = styles[row[2]];
+        var icon = L.AwesomeMarkers.icon({markerColor: style[0], icon: style[1], prefix: 'glyphicon'});
+        var marker = L.marker(new L.LatLng(row[0], row[1]), {icon: icon});
+        var price = row[4] === null ? '-' : row[4];
+        var roi = row[5] === null ? '-' : row[5];
+        marker.bindPopup('<b>' + row[3] + '</b><br>価格: ' + price + '万円<br>利回り: ' + roi + '%%');
+        marker.bindTooltip('#' + row[6] + ' ' + row[3] + ' (' + style[2] + ')');
+        return marker;
+    };
+})()"""
+
+def add_cluster_markers(layer, df):
+    """
+    All rows as one JSON array of [lat, lon, style, title, price, roi, id], clustered in the browser.
+    Styles are shipped once per status instead of once per marker, so the payload stays small.
+    """
+    styles, style_index = [], {}
+    data = []
+    for row in df.itertuples(index=False):
+        if row.status not in style_index:
+            style_index[row.status] = len(styles)
+            styles.append([*STATUS_STYLES.get(row.status, DEFAULT_STATUS_STYLE), html.escape(str(row.status))])
+        data.append([
+            round(row.latitude, 6), round(row.longitude, 6), style_index[row.status], html.escape(str(row.title)),
+            None if pd.isna(row.price) else row.price, None if pd.isna(row.roi) else row.roi, int(row.id),
+        ])
+    FastMarkerCluster(data, callback=_CLUSTER_CALLBACK % json.dumps(styles, ensure_ascii=False), name="物件").add_to(layer)
+
+# Marker tooltips start with "#<id> " so a click can name its property (see MarkerIndex.resolve)
+_TOOLTIP_ID = re.compile(r"#(\d+) ")
+
+class MarkerIndex:
+    """
+    The markers on a map, by id and by grid cell, for resolving st_folium click results.
+    A click carries its marker's tooltip, and so the property id; coordinates alone are the
+    fallback, matched against the markers in the clicked cell and its neighbours.
+    """
+    CELL = 0.001 # degrees (~100 m); must be >= the max_distance used with nearest()
+
+    def __init__(self, df):
+        self._rows = {}
+        self._grid = {}
+        for row in df.itertuples(index=False):
+            self._rows[int(row.id)] = row
+            self._grid.setdefault(self._cell(row.latitude, row.longitude), []).append(row)
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.CELL), math.floor(lon / self.CELL)
+
+    def get(self, prop_id):
+        return self._rows.get(prop_id)
+
+    def nearest(self, lat, lon, max_distance=0.0001):
+        cell_lat, cell_lon = self._cell(lat, lon)
+        best, best_distance = None, max_distance
+        for d_lat in (-1, 0, 1):
+            for d_lon in (-1, 0, 1):
+                for row in self._grid.get((cell_lat + d_lat, cell_lon + d_lon), ()):
+                    distance = math.hypot(row.latitude - lat, row.longitude - lon)
+                    if distance <= best_distance:
+                        best, best_distance = row, distance
+        return best
+
+    def resolve(self, map_data):
+        """Row of the marker behind st_folium's last_object_clicked, or None."""
+        clicked = map_data.get("last_object_clicked")
+        if not clicked:
+            return None
+        match = _TOOLTIP_ID.match(map_data.get("last_object_clicked_tooltip") or "")
+        if match and self.get(int(match.group(1))) is not None:
+            return self.get(int(match.group(1)))
+        # Marker clicks return the marker's own position, so a tight probe is enough
+        return self.nearest(clicked["lat"], clicked["lng"])
 
 # --- Session State Init ---
-init_db()
+# The database and the geocode worker are opened lazily (get_db() / get_geocode_worker()) by
+# the views that need them, so Scout reruns never touch the ledger.
 if "messages" not in st.session_state: st.session_state.messages = []
 if "analysis_result" not in st.session_state: st.session_state.analysis_result = None
 if "address_val" not in st.session_state: st.session_state.address_val = ""
@@ -476,6 +2604,7 @@ if "map_center" not in st.session_state: st.session_state.map_center = [35.67, 1
 if "view_mode" not in st.session_state: st.session_state.view_mode = "list"
 if "selected_property_id" not in st.session_state: st.session_state.selected_property_id = None
 if "last_geocoded_address" not in st.session_state: st.session_state.last_geocoded_address = ""
+if "geocode_precision" not in st.session_state: st.session_state.geocode_precision = None
 if "saved_audio_ids" not in st.session_state: st.session_state.saved_audio_ids = []
 
 # --- Sidebar ---
@@ -515,6 +2644,42 @@ with st.sidebar:
     
     st.markdown("---")
     st.info("Kyotango Property Platform v3.0")
+
+    if setting_enabled("DEBUG"):
+        with st.expander("🛠️ ジオコーダ統計 (debug)"):
+            st.caption(f"Providers: {' → '.join(p.name for p in get_geocoder_chain().providers)} / Nominatim: {get_geocoding_client().endpoint}")
+            provider_stats = get_geocoder_chain().stats()
+            if provider_stats:
+                st.dataframe(pd.DataFrame(provider_stats), hide_index=True)
+            else:
+                st.caption("まだ呼び出しはありません。")
+            missing = get_gazetteer().missing_oaza()
+            oaza_total = sum(len(names) for names in KYOTANGO_OAZA.values())
+            st.caption(f"地名辞書: 大字 {oaza_total - len(missing)}/{oaza_total} 件に座標あり（他は町の中心で代用）")
+
+    tile_cache = get_tile_cache()
+    if tile_cache is None and setting_enabled("TILE_CACHE"):
+        st.warning(f"⚠️ タイルキャッシュを起動できませんでした（ポート {get_setting('TILE_CACHE_PORT', 8765)} が使用中の可能性）。通常の地図配信を使用します。")
+    if tile_cache is not None:
+        with st.expander("🗺️ オフライン地図 (タイルキャッシュ)"):
+            for source, store in tile_cache.stores.items():
+                count, size = store.stats()
+                st.caption(f"{source}: {count:,}枚 / {size / 1e6:.1f} MB")
+            st.caption(f"ヒット {tile_cache.hits} / 取得 {tile_cache.misses} / 期限切れ配信 {tile_cache.stale} / 失敗 {tile_cache.errors}")
+            seeding = tile_cache.seeding
+            if seeding and seeding["running"]:
+                st.progress(seeding["done"] / max(seeding["total"], 1), text=f"{seeding['source']}: {seeding['done']}/{seeding['total']}枚")
+                if st.button("事前取得を中止", key="tile_seed_cancel"):
+                    seeding["cancel"] = True
+            else:
+                seed_source = st.selectbox("事前取得する地図", [s for s, spec in TILE_SOURCES.items() if spec["seedable"]], key="tile_seed_source")
+                seed_zooms = st.slider("ズーム範囲", 8, 18, (10, 16), key="tile_seed_zooms")
+                zooms = range(seed_zooms[0], seed_zooms[1] + 1)
+                tile_count = sum(len(tiles_in_bbox(KYOTANGO_BBOX, z)) for z in zooms)
+                st.caption(f"京丹後市全域: {tile_count:,}枚（取得済みはスキップ、OSMは閲覧時のみキャッシュ）")
+                if st.button("京丹後市全域を事前取得", key="tile_seed_start"):
+                    tile_cache.seed(seed_source, KYOTANGO_BBOX, zooms)
+                    st.rerun()
     
     # Logout Button (Always show if credentials exist)
     if "credentials" in st.session_state and st.session_state.credentials:
@@ -546,72 +2711,176 @@ st.title("Kyotango Property Platform")
 if st.session_state.credentials and hasattr(st.session_state.credentials, 'client_id'):
     st.caption(f"Logged in as: {st.session_state.credentials.client_id[:10]}...")
 
-# Tabs
-tab_scout, tab_manage, tab_chat = st.tabs(["🔍 目利き(Scout)", "📂 物件台帳(Manage)", "💬 経営会議(Consultant)"])
+# Views: unlike st.tabs, only the selected view's code runs on a rerun
+VIEWS = {"scout": "🔍 目利き(Scout)", "manage": "📂 物件台帳(Manage)", "chat": "💬 経営会議(Consultant)"}
+# Ledger widgets keep their values while another view is shown (Streamlit drops the state of
+# widgets that aren't rendered unless the key is reassigned in that run)
+MANAGE_WIDGET_KEYS = [
+    "filter_statuses", "filter_ratings", "filter_price_min", "filter_price_max", "filter_roi_min",
+    "sort_column", "sort_desc", "page_size", "ledger_search",
+    "map_render_mode", "map_heat", "map_heat_metric", "map_areas",
+]
+
+active_view = st.radio("表示", list(VIEWS), format_func=VIEWS.get, horizontal=True, key="active_view", label_visibility="collapsed")
+if active_view != "manage":
+    for widget_key in MANAGE_WIDGET_KEYS:
+        if widget_key in st.session_state:
+            st.session_state[widget_key] = st.session_state[widget_key]
+
+# --- Fragments ---
+# The map, detail, gallery and chat panels below are st.fragment units: their own widgets
+# rerun only that function, so a click doesn't rebuild the sidebar, the ledger or other maps.
+def rerun_fragment():
+    """Rerun just the calling fragment (or the whole app when it is running as part of a full rerun)."""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+# --- Scout Geocoding ---
+GEOCODE_DEBOUNCE = 0.8 # seconds an address must stay unchanged before it costs a Nominatim request
+
+def schedule_geocode(address):
+    """
+    Move the Scout map to `address`. Cache / gazetteer answers apply at once; anything needing
+    the network is sent after GEOCODE_DEBOUNCE and picked up by geocode_fill(). A newer address
+    supersedes (and, if still queued, cancels) the previous lookup.
+    """
+    cancel_geocode()
+    st.session_state.last_geocoded_address = address
+    if not address.strip():
+        st.session_state.geocode_notice = None
+        return
+    canonical, town_key = normalize_address(address)
+    settled = get_geocoder_chain().geocode_local(canonical, town_key)
+    if settled:
+        _apply_geocode(settled)
+    else:
+        st.session_state.geocode_request = {"address": address, "requested_at": time.time(), "future": None}
+
+def cancel_geocode():
+    request = st.session_state.pop("geocode_request", None)
+    if request and request["future"] is not None:
+        get_geocoding_client().abandon(request["future"])
+
+def _apply_geocode(coords):
+    lat, lon, precision = coords
+    st.session_state.map_center = [lat, lon]
+    st.session_state.geocode_precision = precision
+    st.session_state.geocode_notice = precision
+
+def geocode_fill():
+    """Polls the pending Scout lookup (only while there is one) and moves the map when it resolves."""
+    request = st.session_state.get("geocode_request")
+    if request:
+        _geocode_poll(request)
+
+@st.fragment(run_every=0.5)
+def _geocode_poll(request):
+    if st.session_state.get("geocode_request") is not request:
+        return # Superseded by a newer address
+    if request["future"] is None:
+        if time.time() - request["requested_at"] < GEOCODE_DEBOUNCE:
+            return
+        request["future"] = request_coords(request["address"])
+    if not request["future"].done():
+        st.caption("📍 住所から座標を検索中…")
+        return
+    del st.session_state.geocode_request
+    _apply_geocode(request["future"].result())
+    st.rerun() # A nested fragment can't rerun just its parent panel; this happens once per lookup
+
+# --- Click-to-Address ---
+def request_click_address(target, lat, lon, **context):
+    """Start the reverse lookup for a map click; address_fill(target) picks up the result."""
+    st.session_state.pending_address = {"target": target, "future": request_address(lat, lon), **context}
+
+def address_fill(target):
+    """Fill `target`'s address field once its pending lookup resolves; polls only while one is pending."""
+    pending = st.session_state.get("pending_address")
+    if pending and pending["target"] == target:
+        _address_fill_poll(pending)
+
+@st.fragment(run_every=1)
+def _address_fill_poll(pending):
+    if st.session_state.get("pending_address") is not pending:
+        return # Superseded by a newer click
+    if not pending["future"].done():
+        st.caption("🏠 クリック地点の住所を取得中…")
+        return
+    del st.session_state.pending_address
+    address = pending["future"].result()
+    if not address:
+        st.toast("住所を自動取得できませんでした。手入力してください。")
+        return
+    if pending["target"] == "scout":
+        st.session_state.address_val = address
+        st.session_state.last_geocoded_address = address # Keep the clicked point; don't geocode it back
+    elif st.session_state.get("fix_prop_id") == pending.get("prop_id"):
+        st.session_state.fix_address = address
+    st.rerun()
+
+# --- Scout Map ---
+@st.fragment
+def scout_map_panel():
+    """Address input, geocode notice and the Scout map; typing and map clicks rerun only this panel."""
+    address_input = st.text_input("物件住所を入力 (または地図で指定)", value=st.session_state.address_val)
+    st.session_state.address_val = address_input
+
+    # Auto-Geocode (Only if address changed); network lookups finish in the background
+    if address_input != st.session_state.last_geocoded_address:
+        schedule_geocode(address_input)
+    geocode_fill()
+
+    lat, lon = st.session_state.map_center
+    notice = st.session_state.get("geocode_notice")
+    if notice == "exact":
+        st.success(f"📍 座標を取得しました: {lat:.5f}, {lon:.5f}")
+    elif notice == "town":
+        st.warning(f"⚠️ 詳細な番地が見つかりません。町域の中心を表示します: {lat:.5f}, {lon:.5f}")
+    elif notice == "city":
+        st.error("⚠️ 住所が特定できませんでした。京丹後市役所周辺を表示します。地図をタップして位置を指定してください。")
+
+    # Map Interaction
+    map_center = st.session_state.map_center
+
+    # Map with Layers
+    m_scout = _add_base_layers(folium.Map(location=map_center, zoom_start=13, tiles=None, height=400))
+
+    # Marker
+    folium.Marker(map_center, popup="Target", icon=folium.Icon(color="red")).add_to(m_scout)
+
+    map_data = st_folium(m_scout, width="100%", height=400, returned_objects=["last_clicked"], key="scout_map")
+
+    # Handle Map Click
+    current_lat = st.session_state.map_center[0]
+    current_lon = st.session_state.map_center[1]
+
+    if map_data and map_data.get("last_clicked"):
+        clicked_lat = map_data["last_clicked"]["lat"]
+        clicked_lng = map_data["last_clicked"]["lng"]
+
+        # Update if clicked different location
+        if abs(clicked_lat - current_lat) > 0.00001 or abs(clicked_lng - current_lon) > 0.00001:
+            st.session_state.map_center = [clicked_lat, clicked_lng]
+            st.session_state.geocode_precision = "manual"
+            st.session_state.geocode_notice = None
+            cancel_geocode() # The click wins over a lookup still in flight
+            request_click_address("scout", clicked_lat, clicked_lng)
+            rerun_fragment()
+
+    # Display Coordinates
+    st.info(f"📍 現在選択中の座標: 緯度 {st.session_state.map_center[0]:.5f}, 経度 {st.session_state.map_center[1]:.5f}")
+    address_fill("scout")
 
 # --- Scout Tab ---
-with tab_scout:
+if active_view == "scout":
     st.header("現地スカウト・目利き")
     
     col_input, col_map = st.columns([1, 1])
     
     with col_input:
-        address_input = st.text_input("物件住所を入力 (または地図で指定)", value=st.session_state.address_val)
-        st.session_state.address_val = address_input
-        
-        # Auto-Geocode (Only if address changed)
-        if address_input != st.session_state.last_geocoded_address:
-            coords = get_coords_from_address(address_input)
-            # print(f"DEBUG: Coords returned: {coords}")
-            if coords:
-                lat, lon, precision = coords
-                
-                if precision == "exact":
-                    st.success(f"📍 座標を取得しました: {lat:.5f}, {lon:.5f}")
-                    st.session_state.map_center = [lat, lon]
-                elif precision == "town":
-                    st.warning(f"⚠️ 詳細な番地が見つかりません。町域の中心を表示します: {lat:.5f}, {lon:.5f}")
-                    st.session_state.map_center = [lat, lon]
-                else: # city
-                    st.error("⚠️ 住所が特定できませんでした。京丹後市役所周辺を表示します。地図をタップして位置を指定してください。")
-                    st.session_state.map_center = [lat, lon]
-                
-                st.session_state.last_geocoded_address = address_input
-            else:
-                st.error("システムエラー: 座標取得ロジックが失敗しました。")
-                st.session_state.last_geocoded_address = address_input # Prevent infinite retry loop
-
-        # Map Interaction
-        map_center = st.session_state.map_center
-        
-        # Map with Layers
-        m_scout = folium.Map(location=map_center, zoom_start=13, tiles=None, height=400)
-        folium.TileLayer('Esri.WorldImagery', name='衛星写真 (Satellite)', attr='Esri', show=True).add_to(m_scout)
-        folium.TileLayer('CartoDB positron', name='戦略マップ (Strategic)', show=False).add_to(m_scout)
-        folium.TileLayer('OpenStreetMap', name='標準マップ (Standard)', show=False).add_to(m_scout)
-        folium.LayerControl().add_to(m_scout)
-        
-        # Marker
-        folium.Marker(map_center, popup="Target", icon=folium.Icon(color="red")).add_to(m_scout)
-        
-        map_data = st_folium(m_scout, width="100%", height=400, returned_objects=["last_clicked"])
-        
-        # Handle Map Click
-        current_lat = st.session_state.map_center[0]
-        current_lon = st.session_state.map_center[1]
-        
-        if map_data and map_data.get("last_clicked"):
-            clicked_lat = map_data["last_clicked"]["lat"]
-            clicked_lng = map_data["last_clicked"]["lng"]
-            
-            # Update if clicked different location
-            if abs(clicked_lat - current_lat) > 0.00001 or abs(clicked_lng - current_lon) > 0.00001:
-                st.session_state.map_center = [clicked_lat, clicked_lng]
-                st.rerun()
-        
-        # Display Coordinates
-        st.info(f"📍 現在選択中の座標: 緯度 {st.session_state.map_center[0]:.5f}, 経度 {st.session_state.map_center[1]:.5f}")
-
+        scout_map_panel()
 
         st.markdown("---")
         st.subheader("音声・写真入力")
@@ -673,10 +2942,13 @@ with tab_scout:
                         # Update coordinates based on address in analysis if available?
                         # For now, rely on input address.
                         
-                        # Ensure we have coordinates for saving
-                        coords = get_coords_from_address(st.session_state.address_val)
-                        if coords:
-                            st.session_state.map_center = [coords[0], coords[1]]
+                        # Coordinates for saving: wait only if the address is new or its lookup is still in flight
+                        if st.session_state.last_geocoded_address != st.session_state.address_val or "geocode_request" in st.session_state:
+                            coords = get_coords_from_address(st.session_state.address_val) # Joins an in-flight lookup
+                            cancel_geocode()
+                            if coords:
+                                _apply_geocode(coords)
+                                st.session_state.last_geocoded_address = st.session_state.address_val
                         
                         # Drive Backup (Scout Phase)
                         if DRIVE_ENABLED and os.path.exists('credentials.json') and audio_source:
@@ -757,7 +3029,8 @@ with tab_scout:
                 "renovation_cost": res.get('renovation_estimate', 0),
                 "roi": res.get('roi_estimate', 0.0),
                 "details_json": json.dumps(res, ensure_ascii=False),
-                "legal_risks": res.get('legal_risks', '')
+                "legal_risks": res.get('legal_risks', ''),
+                "geocode_status": st.session_state.geocode_precision
             }
             
             prop_id = save_property(save_data)
@@ -776,140 +3049,457 @@ with tab_scout:
             time.sleep(1)
             st.rerun()
 
+@st.fragment(run_every=2)
+def _geocode_progress(worker):
+    """Live progress of background geocoding; reruns on its own every 2 seconds."""
+    pending = worker.pending_count()
+    state = worker.job_state()
+    rate = worker.throughput()
+    if pending:
+        eta = f"約{int(pending / rate)}秒" if rate else "計測中"
+        st.info(f"🌐 座標未取得: {pending}件（バックグラウンドで順次取得中、残り{eta}）")
+    if state.get("status") in ("running", "paused"):
+        total = max(state["total"], 1)
+        done = min(state["processed"], total)
+        label = f"{done}/{state['total']}件 処理済み・{state['improved']}件 改善"
+        if state["status"] == "running" and rate:
+            label += f"（{rate:.2f}件/秒、残り約{int((total - done) / rate)}秒）"
+        elif state["status"] == "paused":
+            label += "（一時停止中）"
+        st.progress(done / total, text=label)
+    if worker.last_error:
+        st.caption(f"⚠️ 直近のエラー: {worker.last_error}")
+
+def geocode_backfill_panel():
+    """Start / pause / resume the coordinate backfill job."""
+    worker = get_geocode_worker()
+    state = worker.job_state()
+    status = state.get("status")
+    with st.expander("🛰️ 座標の一括補正", expanded=status == "running"):
+        st.caption("町域・市域レベルの座標や座標未設定の物件を、住所から順次再取得します（1件/秒）。中断しても続きから再開できます。")
+        if status == "done":
+            st.success(f"前回の補正は完了しました（{state['processed']}件を確認、{state['improved']}件を改善）")
+        c1, c2 = st.columns(2)
+        if status == "running":
+            if c1.button("⏸️ 一時停止", key="backfill_pause"):
+                worker.pause_backfill()
+                st.rerun()
+        elif status == "paused":
+            if c1.button("▶️ 再開", key="backfill_resume"):
+                worker.resume_backfill()
+                st.rerun()
+        candidates = worker.backfill_candidates()
+        if c2.button(f"🔄 開始（対象 {candidates}件）", key="backfill_start", disabled=candidates == 0 or status == "running"):
+            worker.start_backfill()
+            st.rerun()
+        _geocode_progress(worker)
+
+# --- Portfolio Map ---
+@st.fragment
+def portfolio_map_panel(ledger_filters):
+    """
+    Global map with its display controls. Panning, zooming, toggling layers and clicking a marker
+    rerun only this panel; a clicked property can be opened from here, and the list below picks up
+    the selection on its next run.
+    """
+    st.markdown("#### 🗺️ 全体マップ (戦略ビュー)")
+
+    # Overall extent decides the initial view; markers are then loaded only for the
+    # viewport the map last reported, via the R*Tree. Both queries are reused until the
+    # ledger or the view changes, so unrelated widget reruns skip them.
+    data_version = get_db().data_version()
+    filter_key = repr(ledger_filters)
+    min_lat, min_lon, max_lat, max_lon, valid_count = session_map_cache(
+        "portfolio_extent", (data_version, filter_key), lambda: portfolio_extent(**ledger_filters)
+    )
+
+    # Calculate bounds for auto-zoom
+    if valid_count:
+        # Center is still useful for initial init
+        center_lat = (min_lat + max_lat) / 2
+        center_lon = (min_lon + max_lon) / 2
+
+        # Check if single point (or very close points)
+        is_single_point = (max_lat - min_lat < 0.001) and (max_lon - min_lon < 0.001)
+    else:
+        center_lat, center_lon = 35.62, 135.06 # Default Kyotango
+        is_single_point = False
+
+    m_portfolio = folium.Map(
+        location=[center_lat, center_lon], 
+        zoom_start=10 if not is_single_point else 14, 
+        tiles=None, 
+        height=400
+    )
+
+    _add_base_layers(m_portfolio)
+
+    # Fit bounds if multiple properties exist
+    if valid_count and not is_single_point:
+        # Add a small buffer to the bounds
+        m_portfolio.fit_bounds([[min_lat, min_lon], [max_lat, max_lon]], padding=(50, 50))
+
+    # Viewport reported by the previous render (None until the map has loaded)
+    viewport = (st.session_state.get("global_map") or {}).get("bounds")
+    if viewport and viewport.get("_southWest") and viewport["_southWest"].get("lat") is not None:
+        sw, ne = viewport["_southWest"], viewport["_northEast"]
+        # Pad by 20% so small pans don't leave empty edges
+        pad_lat = (ne["lat"] - sw["lat"]) * 0.2
+        pad_lon = (ne["lng"] - sw["lng"]) * 0.2
+        view_box = (sw["lat"] - pad_lat, sw["lng"] - pad_lon, ne["lat"] + pad_lat, ne["lng"] + pad_lon)
+    elif valid_count:
+        view_box = (min_lat, min_lon, max_lat, max_lon)
+    else:
+        view_box = None
+
+    render_mode = st.radio("マーカー表示", ["自動", "ピン", "クラスタ"], horizontal=True, key="map_render_mode",
+                           help=f"自動: {MARKER_CLUSTER_THRESHOLD}件を超えるとブラウザ側でクラスタ表示します")
+
+    c_heat, c_metric, c_area = st.columns([1, 1, 1])
+    show_heat = c_heat.toggle("🔥 ヒートマップ", key="map_heat")
+    heat_metric = c_metric.selectbox("指標", list(HEATMAP_METRICS), key="map_heat_metric", disabled=not show_heat, label_visibility="collapsed")
+    show_areas = c_area.toggle("🗾 エリア集計", key="map_areas")
+
+    valid_df = session_map_cache(
+        "global_markers", (data_version, filter_key, view_box),
+        lambda: properties_in_bbox(*view_box, columns=MAP_COLUMNS, **ledger_filters) if view_box else pd.DataFrame(columns=MAP_COLUMNS)
+    )
+
+    # Markers go into a separate feature group so loading a new viewport updates them
+    # in place instead of re-mounting (and re-zooming) the whole map.
+    fg_markers = folium.FeatureGroup(name="物件")
+    use_cluster = render_mode == "クラスタ" or (render_mode == "自動" and len(valid_df) > MARKER_CLUSTER_THRESHOLD)
+    if use_cluster:
+        add_cluster_markers(fg_markers, valid_df)
+    else:
+        add_pin_markers(fg_markers, valid_df)
+
+    # Heatmap / town layers render from a small grid binned once per ledger version
+    overlay_layers = []
+    if show_heat or show_areas:
+        heat_grid, areas = session_map_cache(
+            "portfolio_aggregates", (data_version, filter_key), lambda: portfolio_aggregates(**ledger_filters)
+        )
+        if show_heat:
+            fg_heat = folium.FeatureGroup(name="ヒートマップ")
+            add_heatmap_layer(fg_heat, heat_grid, HEATMAP_METRICS[heat_metric])
+            overlay_layers.append(fg_heat)
+        if show_areas:
+            fg_areas = folium.FeatureGroup(name="エリア集計")
+            add_area_layer(fg_areas, areas)
+            overlay_layers.append(fg_areas)
+
+    # Debug Info
+    with st.expander("🛠️ マップデバッグ情報"):
+        st.write(f"Valid Properties: {valid_count} (in view: {len(valid_df)}, {'cluster' if use_cluster else 'pins'})")
+        if valid_count:
+            st.write(f"Bounds: [{min_lat}, {min_lon}] - [{max_lat}, {max_lon}]")
+            st.write(f"Is Single Point: {is_single_point}")
+        else:
+            st.write("No valid properties found.")
+
+    # Render Map & Capture Click
+    map_data = st_folium(
+        m_portfolio, 
+        width="100%", 
+        height=400, 
+        feature_group_to_add=[*overlay_layers, fg_markers],
+        returned_objects=["last_object_clicked", "last_object_clicked_tooltip", "bounds"],
+        key="global_map"
+    )
+
+    marker_index = session_map_cache("marker_index", (data_version, filter_key, view_box), lambda: MarkerIndex(valid_df))
+    # st_folium repeats the last click on every rerun; only a new one changes the selection
+    click = map_data and (map_data.get("last_object_clicked_tooltip"), str(map_data.get("last_object_clicked")))
+    if click and click != st.session_state.get("global_map_last_click"):
+        st.session_state.global_map_last_click = click
+        clicked_prop = marker_index.resolve(map_data)
+        if clicked_prop is not None:
+            st.session_state.selected_property_id = int(clicked_prop.id)
+            st.toast(f"物件を選択しました: {clicked_prop.title}")
+
+    # Opening the detail view changes the whole tab, so only this button reruns the app
+    selected = marker_index.get(st.session_state.selected_property_id)
+    if selected is not None:
+        col_selected, col_open = st.columns([3, 1])
+        col_selected.caption(f"選択中: #{selected.id} {selected.title} ({selected.status})")
+        if col_open.button("詳細へ移動 ➡️", key="map_open_detail"):
+            st.session_state.view_mode = "detail"
+            st.rerun()
+
+    if show_areas and areas:
+        st.dataframe(pd.DataFrame(areas).drop(columns="bbox"), hide_index=True, column_config={
+            "平均利回り(%)": st.column_config.NumberColumn(format="%.1f"),
+            "平均価格(万円)": st.column_config.NumberColumn(format="%.0f"),
+            "利回り10%以上": st.column_config.ProgressColumn(min_value=0, max_value=1, format="percent"),
+        })
+
+# --- Property Detail ---
+@st.fragment
+def detail_location_panel(prop_id):
+    """Satellite map and coordinate / address fixes; clicks and saves rerun only this panel."""
+    selected_row = get_property(prop_id)
+    if selected_row is None:
+        return # Deleted meanwhile; the next full run goes back to the list
+
+    col_l, col_r = st.columns([1, 1])
+
+    with col_l:
+        # Map
+        lat = selected_row['latitude']
+        lon = selected_row['longitude']
+
+        # Handle NaN/None coordinates
+        if pd.isna(lat) or pd.isna(lon) or lat == 0 or lon == 0:
+            st.warning("⚠️ 座標が設定されていません。手動で入力するか、住所から再取得してください。")
+            # Default to Kyotango City Hall for display
+            map_lat, map_lon = 35.62, 135.06
+            has_valid_coords = False
+        else:
+            map_lat, map_lon = lat, lon
+            has_valid_coords = True
+
+        # Initialize session state for inputs if not set or if property changed
+        if "fix_lat" not in st.session_state or st.session_state.get("fix_prop_id") != selected_row['id']:
+            st.session_state.fix_lat = selected_row['latitude'] if pd.notna(selected_row['latitude']) else 0.0
+            st.session_state.fix_lon = selected_row['longitude'] if pd.notna(selected_row['longitude']) else 0.0
+            st.session_state.fix_prop_id = selected_row['id']
+            st.session_state.fix_address = selected_row['address'] or ""
+
+        # Use session state coordinates for map display to reflect manual fixes immediately
+        display_lat = st.session_state.fix_lat if st.session_state.fix_lat != 0 else map_lat
+        display_lon = st.session_state.fix_lon if st.session_state.fix_lon != 0 else map_lon
+
+        # Map Configuration (Satellite)
+        m_detail = folium.Map(
+            location=[display_lat, display_lon], 
+            zoom_start=18, # Closer zoom for satellite
+            tiles=None,
+            height=400
+        )
+        tile_layer("esri", '衛星写真 (Satellite)').add_to(m_detail)
+
+        if has_valid_coords:
+            folium.Marker(
+                [display_lat, display_lon],
+                popup=selected_row['title'],
+                icon=folium.Icon(color="red" if selected_row['status'] == "購入済み" else "blue")
+            ).add_to(m_detail)
+
+        # Render Map & Capture Click
+        map_data = st_folium(m_detail, width="100%", height=400, returned_objects=["last_clicked"], key="detail_map")
+
+        # Handle Map Click
+        if map_data and map_data.get("last_clicked"):
+            clicked_lat = map_data["last_clicked"]["lat"]
+            clicked_lng = map_data["last_clicked"]["lng"]
+
+            # Update inputs (st_folium keeps reporting the last click on every rerun; act on new ones only)
+            if st.session_state.get("detail_last_click") != (clicked_lat, clicked_lng):
+                st.session_state.detail_last_click = (clicked_lat, clicked_lng)
+                st.session_state.fix_lat = clicked_lat
+                st.session_state.fix_lon = clicked_lng
+                request_click_address("detail", clicked_lat, clicked_lng, prop_id=selected_row['id'])
+                rerun_fragment()
+
+    with col_r:
+        st.markdown("#### 📍 位置情報の修正")
+        if selected_row.get("geocode_status") == "town":
+            st.warning("⚠️ この座標は町域（大字）の中心による仮置きです。地図で正確な位置を指定してください。")
+        elif selected_row.get("geocode_status") == "city":
+            st.warning("⚠️ この座標は京丹後市役所周辺の仮置きです。地図で正確な位置を指定してください。")
+        st.info("地図をクリックすると、その場所の座標と住所が自動的に入力されます。")
+
+        new_lat = st.number_input("緯度", value=st.session_state.fix_lat, format="%.6f")
+        new_lon = st.number_input("経度", value=st.session_state.fix_lon, format="%.6f")
+        new_address = st.text_input("住所", value=st.session_state.fix_address)
+        address_fill("detail")
+
+        c_btn, _ = st.columns([1, 2])
+        with c_btn:
+            st.write("") # Spacer
+            st.write("")
+            if st.button("座標更新"):
+                update_properties(selected_row['id'], latitude=new_lat, longitude=new_lon, address=new_address, geocode_status="manual")
+                st.toast("座標を更新しました！")
+                time.sleep(0.5)
+                rerun_fragment()
+
+
+        if st.button("住所から座標を再取得 (京都府付与)"):
+            coords = get_coords_from_address(selected_row['address'])
+            if coords:
+                lat, lon, precision = coords
+                update_properties(selected_row['id'], latitude=lat, longitude=lon, geocode_status=precision)
+
+                st.session_state.fix_lat = lat
+                st.session_state.fix_lon = lon
+
+                msg = "座標を更新しました！"
+                if precision != "exact":
+                    msg += f" (精度: {precision} - 地図で微調整してください)"
+
+                st.toast(msg)
+                time.sleep(1)
+                rerun_fragment()
+            else:
+                st.error("座標を取得できませんでした。")
+
+        photo_gallery(prop_id)
+
+@st.fragment
+def photo_gallery(prop_id):
+    """Photo album of one property; adding photos reruns only the album."""
+    st.markdown("---")
+    st.subheader("🖼 物件アルバム")
+    album = st.container()
+
+    # Add Photos
+    st.markdown("##### ➕ 写真を追加")
+    new_photos = st.file_uploader("追加の写真を選択", type=['png', 'jpg', 'jpeg'], accept_multiple_files=True, key="add_photos_manage")
+    img_dir = f"data/images/{prop_id}"
+    # The uploader keeps its files across reruns; write each one once
+    saved_ids = st.session_state.setdefault("saved_photo_ids", set())
+    fresh_photos = [f for f in new_photos or [] if f.file_id not in saved_ids]
+    if fresh_photos:
+        os.makedirs(img_dir, exist_ok=True)
+        for img_file in fresh_photos:
+            with open(os.path.join(img_dir, img_file.name), "wb") as f:
+                f.write(img_file.getbuffer())
+            saved_ids.add(img_file.file_id)
+        st.toast("写真を追加しました！")
+
+    with album:
+        if os.path.exists(img_dir):
+            images = [f for f in os.listdir(img_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+            if images:
+                cols = st.columns(3)
+                for idx, img_file in enumerate(images):
+                    with cols[idx % 3]:
+                        st.image(os.path.join(img_dir, img_file), use_container_width=True, caption=img_file)
+            else:
+                st.write("写真はありません")
+        else:
+            st.write("写真はありません")
+
 # --- Manage Tab ---
-with tab_manage:
+if active_view == "manage":
     st.header("物件台帳・ポートフォリオ")
+    get_geocode_worker() # Starts the background geocoder for imported rows (once per process)
     
-    df = get_all_properties()
+    # --- Bulk Import ---
+    with st.expander("📥 一括インポート (CSV / Excel)"):
+        st.caption("列名の例: 物件名, 住所, 価格, 緯度, 経度, 特徴, 評価, メモ, ステータス, リノベ費用, 利回り, 法的リスク（住所は必須）")
+        listing_file = st.file_uploader("物件リストを選択", type=["csv", "xlsx"], key="listing_import")
+        if st.button("インポート", disabled=listing_file is None):
+            try:
+                imported = import_listings(listing_file)
+                st.toast(f"{imported}件の物件をインポートしました")
+            except (ValueError, UnicodeDecodeError, pd.errors.ParserError) as e:
+                st.error(f"インポートに失敗しました: {e}")
+
+    geocode_backfill_panel()
     
-    if df.empty:
+    if count_properties() == 0:
         st.info("登録された物件はありません。")
     else:
         # --- View A: List Mode ---
         if st.session_state.view_mode == "list":
-            # Global Map
-            st.markdown("#### 🗺️ 全体マップ (戦略ビュー)")
-            
-            # Filter for valid coordinates (exclude None, 0, and empty strings)
-            # Ensure lat/lon are numeric, coerce errors to NaN
-            df['latitude'] = pd.to_numeric(df['latitude'], errors='coerce')
-            df['longitude'] = pd.to_numeric(df['longitude'], errors='coerce')
-
-            valid_df = df[
-                (df['latitude'].notna()) & (df['latitude'] != 0) &
-                (df['longitude'].notna()) & (df['longitude'] != 0)
-            ]
-            
-            # Calculate bounds for auto-zoom
-            if not valid_df.empty:
-                min_lat, max_lat = valid_df['latitude'].min(), valid_df['latitude'].max()
-                min_lon, max_lon = valid_df['longitude'].min(), valid_df['longitude'].max()
-                
-                # Center is still useful for initial init
-                center_lat = (min_lat + max_lat) / 2
-                center_lon = (min_lon + max_lon) / 2
-                
-                # Check if single point (or very close points)
-                is_single_point = (max_lat - min_lat < 0.001) and (max_lon - min_lon < 0.001)
-            else:
-                center_lat, center_lon = 35.62, 135.06 # Default Kyotango
-                is_single_point = False
-
-            m_portfolio = folium.Map(
-                location=[center_lat, center_lon], 
-                zoom_start=10 if not is_single_point else 14, 
-                tiles=None, 
-                height=400
+            # Filters & Sort (applied in SQL to both the map and the list)
+            with st.expander("🔎 絞り込み・並び替え"):
+                f1, f2, f3 = st.columns(3)
+                with f1:
+                    filter_statuses = st.multiselect("ステータス", ["検討中", "購入済み", "見送り", "未内見"], key="filter_statuses")
+                    filter_ratings = st.multiselect("評価", ["S", "A", "B", "C"], key="filter_ratings")
+                with f2:
+                    price_min = st.number_input("価格 下限 (万円)", min_value=0, value=0, step=50, key="filter_price_min")
+                    price_max = st.number_input("価格 上限 (万円, 0=指定なし)", min_value=0, value=0, step=50, key="filter_price_max")
+                    roi_min = st.number_input("利回り 下限 (%)", min_value=0.0, value=0.0, step=1.0, key="filter_roi_min")
+                with f3:
+                    sort_labels = {
+                        "登録日": "created_at", "価格": "price", "利回り": "roi",
+                        "想定月商": "expected_revenue_monthly", "総投資額": "total_investment",
+                    }
+                    sort_label = st.selectbox("並び順", list(sort_labels.keys()), key="sort_column")
+                    sort_desc = st.toggle("降順", value=True, key="sort_desc")
+                    page_size = st.selectbox("表示件数", [25, 50, 100, 200], index=1, key="page_size")
+
+            ledger_filters = dict(
+                statuses=filter_statuses or None,
+                ratings=filter_ratings or None,
+                price_range=(price_min or None, price_max or None),
+                roi_range=(roi_min or None, None),
             )
-            
-            # Add Layers
-            folium.TileLayer('Esri.WorldImagery', name='衛星写真 (Satellite)', attr='Esri', show=True).add_to(m_portfolio)
-            folium.TileLayer('CartoDB positron', name='戦略マップ (Strategic)', show=False).add_to(m_portfolio)
-            folium.TileLayer('OpenStreetMap', name='標準マップ (Standard)', show=False).add_to(m_portfolio)
-            
-            folium.LayerControl().add_to(m_portfolio)
-            
-            for index, row in valid_df.iterrows():
-                # Color & Icon Logic
-                status = row['status']
-                if status == "購入済み":
-                    color = "red"
-                    icon_name = "home"
-                elif status == "検討中":
-                    color = "blue"
-                    icon_name = "info-sign"
-                elif status == "見送り":
-                    color = "black"
-                    icon_name = "remove"
-                elif status == "未内見":
-                    color = "gray"
-                    icon_name = "question"
-                else:
-                    color = "orange"
-                    icon_name = "star"
-                
-                folium.Marker(
-                    [row['latitude'], row['longitude']],
-                    popup=f"<b>{row['title']}</b><br>価格: {row['price']}万円<br>利回り: {row['roi']}%",
-                    tooltip=f"{row['title']} ({status})",
-                    icon=folium.Icon(color=color, icon=icon_name)
-                ).add_to(m_portfolio)
-            
-            # Fit bounds if multiple properties exist
-            if not valid_df.empty and not is_single_point:
-                # Add a small buffer to the bounds
-                m_portfolio.fit_bounds([[min_lat, min_lon], [max_lat, max_lon]], padding=(50, 50))
-            
-            # Debug Info
-            with st.expander("🛠️ マップデバッグ情報"):
-                st.write(f"Valid Properties: {len(valid_df)}")
-                if not valid_df.empty:
-                    st.write(f"Bounds: [{min_lat}, {min_lon}] - [{max_lat}, {max_lon}]")
-                    st.write(f"Is Single Point: {is_single_point}")
+
+            # Keyword Search
+            search_query = st.text_input("🔎 キーワード検索 (物件名・住所・特徴・メモ・法的リスク)", key="ledger_search")
+            if search_query.strip():
+                hits = search_properties(search_query)
+                if hits.empty:
+                    st.info("該当する物件はありません。")
                 else:
-                    st.write("No valid properties found.")
-
-            # Render Map & Capture Click
-            # Use dynamic key to force re-render when property count changes, fixing zoom issues
-            map_data = st_folium(
-                m_portfolio, 
-                width="100%", 
-                height=400, 
-                returned_objects=["last_object_clicked"],
-                key=f"global_map_{len(valid_df)}_{int(min_lat*1000) if not valid_df.empty else 0}"
-            )
+                    st.dataframe(hits, use_container_width=True, hide_index=True)
+                    hit_options = {
+                        f"{prop_id}: {title} ({status})": prop_id
+                        for prop_id, title, status in zip(hits['id'], hits['title'], hits['status'])
+                    }
+                    col_hit, col_hit_btn = st.columns([3, 1])
+                    with col_hit:
+                        hit_key = st.selectbox("検索結果から選択", hit_options.keys(), key="search_hit_selector")
+                    with col_hit_btn:
+                        st.write("") # Spacer
+                        st.write("")
+                        if st.button("詳細へ移動 ➡️", key="search_hit_btn"):
+                            st.session_state.selected_property_id = int(hit_options[hit_key])
+                            st.session_state.view_mode = "detail"
+                            st.rerun()
 
-            if map_data and map_data.get("last_object_clicked"):
-                clicked_lat = map_data["last_object_clicked"]["lat"]
-                clicked_lng = map_data["last_object_clicked"]["lng"]
-                
-                # Find closest property (simple exact match or very close proximity)
-                # For robustness, we check for very small difference
-                clicked_prop = valid_df[
-                    (valid_df['latitude'].between(clicked_lat - 0.0001, clicked_lat + 0.0001)) & 
-                    (valid_df['longitude'].between(clicked_lng - 0.0001, clicked_lng + 0.0001))
-                ]
-                
-                if not clicked_prop.empty:
-                    prop_id = clicked_prop.iloc[0]['id']
-                    st.session_state.selected_property_id = int(prop_id)
-                    st.toast(f"物件を選択しました: {clicked_prop.iloc[0]['title']}")
-                    # Optional: Auto-redirect or just update selection
+            # Global Map
+            portfolio_map_panel(ledger_filters)
             
             st.markdown("---")
             st.markdown("#### 📋 物件一覧")
             
-            # Calculate Total Price
-            df['total_price'] = df['price'] + df['renovation_cost']
+            # Keyset pagination: page_cursors[i] is the cursor that starts page i.
+            # Any change to filters / sort starts over from the first page.
+            sort_column = sort_labels[sort_label]
+            page_signature = (repr(ledger_filters), sort_column, sort_desc, page_size)
+            if st.session_state.get("page_signature") != page_signature:
+                st.session_state.page_signature = page_signature
+                st.session_state.page_cursors = [None]
+            cursors = st.session_state.page_cursors
             
-            display_cols = ["id", "status", "title", "price", "renovation_cost", "total_price", "roi", "rating", "address", "latitude", "longitude"]
-            st.dataframe(df[display_cols], use_container_width=True)
+            page_df, next_cursor = query_properties(
+                columns=LIST_COLUMNS, order_by=sort_column, descending=sort_desc,
+                limit=page_size, after=cursors[-1], **ledger_filters
+            )
+            totals = portfolio_totals(**ledger_filters)
+            t1, t2, t3 = st.columns(3)
+            with t1: st.metric("総投資額 (合計)", f"{totals['total_investment']:,.0f}万円")
+            with t2: st.metric("想定月商 (合計)", f"{totals['expected_revenue_monthly']:,.0f}万円")
+            with t3: st.metric("平均利回り", f"{totals['avg_roi']:.1f}%")
+            st.caption(f"{totals['count']}件中 {len(cursors)}ページ目")
+            st.dataframe(page_df, use_container_width=True)
+            
+            col_prev, col_next, _ = st.columns([1, 1, 4])
+            with col_prev:
+                if st.button("◀ 前へ", disabled=len(cursors) == 1):
+                    cursors.pop()
+                    st.rerun()
+            with col_next:
+                if st.button("次へ ▶", disabled=next_cursor is None):
+                    cursors.append(next_cursor)
+                    st.rerun()
             
             # Selection for Detail View
+            selector_df, _ = query_properties(columns=SELECTOR_COLUMNS, **ledger_filters)
             col_sel, col_btn = st.columns([3, 1])
             with col_sel:
                 # Create a label map for selection
-                options = {f"{row['id']}: {row['title']} ({row['status']})": row['id'] for index, row in df.iterrows()}
+                options = {
+                    f"{prop_id}: {title} ({status})": prop_id
+                    for prop_id, title, status in zip(selector_df['id'], selector_df['title'], selector_df['status'])
+                }
                 # Ensure selected_property_id is valid for the selectbox
                 current_index = 0
                 if st.session_state.selected_property_id:
@@ -931,7 +3521,7 @@ with tab_manage:
                 st.write("")
                 if st.button("詳細へ移動 ➡️", type="primary"):
                     if selected_option_key:
-                        st.session_state.selected_property_id = options[selected_option_key]
+                        st.session_state.selected_property_id = int(options[selected_option_key])
                         st.session_state.view_mode = "detail"
                         st.rerun()
 
@@ -941,7 +3531,7 @@ with tab_manage:
                 st.warning("選択した物件を完全に削除します。この操作は取り消せません。")
                 
                 # Multiselect for deletion
-                delete_options = {f"{row['id']}: {row['title']}": row['id'] for index, row in df.iterrows()}
+                delete_options = {f"{prop_id}: {title}": prop_id for prop_id, title in zip(selector_df['id'], selector_df['title'])}
                 selected_delete_keys = st.multiselect(
                     "削除する物件を選択してください",
                     list(delete_options.keys())
@@ -949,11 +3539,7 @@ with tab_manage:
                 
                 if st.button("選択した物件を削除", type="primary"):
                     if selected_delete_keys:
-                        deleted_count = 0
-                        for key in selected_delete_keys:
-                            prop_id = delete_options[key]
-                            delete_property(prop_id)
-                            deleted_count += 1
+                        deleted_count = delete_properties([delete_options[key] for key in selected_delete_keys])
                         
                         st.toast(f"{deleted_count}件の物件を削除しました")
                         time.sleep(1)
@@ -968,7 +3554,11 @@ with tab_manage:
                 st.rerun()
             
             # Get selected property data
-            selected_row = df[df['id'] == st.session_state.selected_property_id].iloc[0]
+            selected_row = get_property(st.session_state.selected_property_id)
+            if selected_row is None:
+                st.session_state.selected_property_id = None
+                st.session_state.view_mode = "list"
+                st.rerun()
             
             # Back Button
             if st.button("⬅️ 物件一覧に戻る"):
@@ -1005,130 +3595,11 @@ with tab_manage:
                 with m1: st.metric("物件価格", f"{selected_row['price']}万円")
                 with m2: st.metric("リノベ概算", f"{selected_row['renovation_cost']}万円")
                 with m3: st.metric("表面利回り", f"{selected_row['roi']}%")
+                m4, m5, _ = st.columns(3)
+                with m4: st.metric("総投資額", f"{selected_row['total_investment']:,.0f}万円" if pd.notna(selected_row['total_investment']) else "-")
+                with m5: st.metric("想定月商", f"{selected_row['expected_revenue_monthly']:,.0f}万円" if pd.notna(selected_row['expected_revenue_monthly']) else "-")
 
-            col_l, col_r = st.columns([1, 1])
-            
-            with col_l:
-                # Map
-                lat = selected_row['latitude']
-                lon = selected_row['longitude']
-                
-                # Handle NaN/None coordinates
-                if pd.isna(lat) or pd.isna(lon) or lat == 0 or lon == 0:
-                    st.warning("⚠️ 座標が設定されていません。手動で入力するか、住所から再取得してください。")
-                    # Default to Kyotango City Hall for display
-                    map_lat, map_lon = 35.62, 135.06
-                    has_valid_coords = False
-                else:
-                    map_lat, map_lon = lat, lon
-                    has_valid_coords = True
-
-                # Initialize session state for inputs if not set or if property changed
-                if "fix_lat" not in st.session_state or st.session_state.get("fix_prop_id") != selected_row['id']:
-                    st.session_state.fix_lat = selected_row['latitude'] if pd.notna(selected_row['latitude']) else 0.0
-                    st.session_state.fix_lon = selected_row['longitude'] if pd.notna(selected_row['longitude']) else 0.0
-                    st.session_state.fix_prop_id = selected_row['id']
-
-                # Use session state coordinates for map display to reflect manual fixes immediately
-                display_lat = st.session_state.fix_lat if st.session_state.fix_lat != 0 else map_lat
-                display_lon = st.session_state.fix_lon if st.session_state.fix_lon != 0 else map_lon
-
-                # Map Configuration (Satellite)
-                m_detail = folium.Map(
-                    location=[display_lat, display_lon], 
-                    zoom_start=18, # Closer zoom for satellite
-                    tiles='Esri.WorldImagery',
-                    attr='Esri',
-                    height=400
-                )
-                
-                if has_valid_coords:
-                    folium.Marker(
-                        [display_lat, display_lon],
-                        popup=selected_row['title'],
-                        icon=folium.Icon(color="red" if selected_row['status'] == "購入済み" else "blue")
-                    ).add_to(m_detail)
-                
-                # Render Map & Capture Click
-                map_data = st_folium(m_detail, width="100%", height=400, returned_objects=["last_clicked"])
-                
-                # Handle Map Click
-                if map_data and map_data.get("last_clicked"):
-                    clicked_lat = map_data["last_clicked"]["lat"]
-                    clicked_lng = map_data["last_clicked"]["lng"]
-                    
-                    # Update inputs
-                    st.session_state.fix_lat = clicked_lat
-                    st.session_state.fix_lon = clicked_lng
-                    st.rerun()
-
-            with col_r:
-                st.markdown("#### 📍 位置情報の修正")
-                st.info("地図をクリックすると、その場所の座標が自動的に入力されます。")
-                
-                new_lat = st.number_input("緯度", value=st.session_state.fix_lat, format="%.6f")
-                new_lon = st.number_input("経度", value=st.session_state.fix_lon, format="%.6f")
-                
-                c_btn, _ = st.columns([1, 2])
-                with c_btn:
-                    st.write("") # Spacer
-                    st.write("")
-                    if st.button("座標更新"):
-                        update_property(selected_row['id'], "latitude", new_lat)
-                        update_property(selected_row['id'], "longitude", new_lon)
-                        st.toast("座標を更新しました！")
-                        time.sleep(0.5)
-                        st.rerun()
-
-                
-                if st.button("住所から座標を再取得 (京都府付与)"):
-                    coords = get_coords_from_address(selected_row['address'])
-                    if coords:
-                        lat, lon, precision = coords
-                        update_property(selected_row['id'], "latitude", lat)
-                        update_property(selected_row['id'], "longitude", lon)
-                        
-                        st.session_state.fix_lat = lat
-                        st.session_state.fix_lon = lon
-                        
-                        msg = "座標を更新しました！"
-                        if precision != "exact":
-                            msg += f" (精度: {precision} - 地図で微調整してください)"
-                        
-                        st.toast(msg)
-                        time.sleep(1)
-                        st.rerun()
-                    else:
-                        st.error("座標を取得できませんでした。")
-                
-                # Photo Gallery
-                st.markdown("---")
-                st.subheader("🖼 物件アルバム")
-                
-                img_dir = f"data/images/{selected_row['id']}"
-                if os.path.exists(img_dir):
-                    images = [f for f in os.listdir(img_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-                    if images:
-                        cols = st.columns(3)
-                        for idx, img_file in enumerate(images):
-                            with cols[idx % 3]:
-                                st.image(os.path.join(img_dir, img_file), use_container_width=True, caption=img_file)
-                    else:
-                        st.write("写真はありません")
-                else:
-                    st.write("写真はありません")
-
-                # Add Photos
-                st.markdown("##### ➕ 写真を追加")
-                new_photos = st.file_uploader("追加の写真を選択", type=['png', 'jpg', 'jpeg'], accept_multiple_files=True, key="add_photos_manage")
-                if new_photos:
-                    os.makedirs(img_dir, exist_ok=True)
-                    for img_file in new_photos:
-                        with open(os.path.join(img_dir, img_file.name), "wb") as f:
-                            f.write(img_file.getbuffer())
-                    st.toast("写真を追加しました！")
-                    time.sleep(1)
-                    st.rerun()
+            detail_location_panel(selected_row['id'])
             
             # --- Enhanced: Evidence Upload & Re-Analysis ---
             st.markdown("---")
@@ -1163,15 +3634,14 @@ with tab_manage:
             # Analysis & Memo
             st.markdown("#### 📝 分析・メモ")
             
-            # Parse Details JSON if available
-            details = {}
-            try:
-                details = json.loads(selected_row['details_json'])
-            except: pass
-            
             st.info(f"💡 **辛口アドバイス**: {selected_row['memo']}") # Using memo field for bitter advice initially saved
             if 'legal_risks' in selected_row and selected_row['legal_risks']:
                  st.warning(f"⚠️ **法的リスク**: {selected_row['legal_risks']}")
+            # pros / cons are materialized from details_json by the database
+            if selected_row['pros']:
+                st.markdown(f"**👍 Pros**: {selected_row['pros']}")
+            if selected_row['cons']:
+                st.markdown(f"**👎 Cons**: {selected_row['cons']}")
             
             # Editable Memo
             st.markdown("##### 追記メモ")
@@ -1191,10 +3661,10 @@ with tab_manage:
                 time.sleep(1)
                 st.rerun()
 
-# --- Chat Tab ---
-with tab_chat:
-    st.header("経営会議 (AI Consultant)")
-    
+# --- Chat Panel ---
+@st.fragment
+def chat_panel(api_key):
+    """History, voice input and chat box; a new message reruns only this panel."""
     # Chat Interface
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
@@ -1281,3 +3751,8 @@ with tab_chat:
                         st.session_state.messages.append({"role": "assistant", "content": response.text})
                     except Exception as e:
                         st.error(f"エラーが発生しました: {e}")
+
+# --- Chat Tab ---
+if active_view == "chat":
+    st.header("経営会議 (AI Consultant)")
+    chat_panel(api_key)
@@ -0,0 +1,128 @@
+"""
+Local stand-in for the Nominatim API (/search and /reverse, format=json) served from fixtures.
+
+Lets the app's geocoding run without network access and with controllable latency, e.g.
+
+    python nominatim_stub.py --port 8088 --latency 150 --jitter 100
+    NOMINATIM_DOMAIN=localhost:8088 NOMINATIM_SCHEME=http NOMINATIM_RATE=50 streamlit run app2.py
+
+Fixtures are a JSON list of {"query", "lat", "lon", "display_name"} objects (--fixtures).
+/search answers queries equal to a fixture's "query"; /reverse answers with the nearest
+fixture within --reverse-radius degrees. Everything else gets Nominatim's empty responses.
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_FIXTURES = [
+    {"query": "京都府京丹後市網野町網野367", "lat": 35.6836, "lon": 135.0290,
+     "display_name": "367, 網野, 網野町, 京丹後市, 京都府, 629-3101, 日本"},
+    {"query": "京都府京丹後市峰山町杉谷889", "lat": 35.6197, "lon": 135.0610,
+     "display_name": "889, 杉谷, 峰山町, 京丹後市, 京都府, 627-0012, 日本"},
+    {"query": "京都府京丹後市丹後町間人1776", "lat": 35.7346, "lon": 135.0930,
+     "display_name": "1776, 間人, 丹後町, 京丹後市, 京都府, 627-0201, 日本"},
+    {"query": "京都府京丹後市久美浜町湊宮1", "lat": 35.6372, "lon": 134.9120,
+     "display_name": "1, 湊宮, 久美浜町, 京丹後市, 京都府, 629-3551, 日本"},
+    {"query": "京都府京丹後市弥栄町溝谷3046", "lat": 35.6672, "lon": 135.0867,
+     "display_name": "3046, 溝谷, 弥栄町, 京丹後市, 京都府, 627-0142, 日本"},
+    {"query": "京都府京丹後市大宮町口大野226", "lat": 35.5812, "lon": 135.0986,
+     "display_name": "226, 口大野, 大宮町, 京丹後市, 京都府, 629-2503, 日本"},
+]
+
+class StubState:
+    def __init__(self, fixtures, latency_ms, jitter_ms, reverse_radius, seed):
+        self.by_query = {f["query"]: f for f in fixtures}
+        self.fixtures = fixtures
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.reverse_radius = reverse_radius
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        with self._lock:
+            self.requests += 1
+            return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+    def search(self, query):
+        fixture = self.by_query.get(query)
+        return [_place(fixture)] if fixture else []
+
+    def reverse(self, lat, lon):
+        nearest = min(self.fixtures, key=lambda f: math.hypot(f["lat"] - lat, f["lon"] - lon), default=None)
+        if nearest is None or math.hypot(nearest["lat"] - lat, nearest["lon"] - lon) > self.reverse_radius:
+            return {"error": "Unable to geocode"}
+        return _place(nearest)
+
+def _place(fixture):
+    # Nominatim returns coordinates as strings
+    return {"lat": str(fixture["lat"]), "lon": str(fixture["lon"]), "display_name": fixture["display_name"]}
+
+class NominatimStubHandler(BaseHTTPRequestHandler):
+    state = None # StubState, set by serve()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        time.sleep(self.state.delay())
+        if url.path in ("/search", "/search.php"):
+            body = self.state.search(params.get("q", ""))
+        elif url.path in ("/reverse", "/reverse.php"):
+            try:
+                body = self.state.reverse(float(params["lat"]), float(params["lon"]))
+            except (KeyError, ValueError):
+                self.send_error(400, "lat and lon are required")
+                return
+        else:
+            self.send_error(404)
+            return
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass # Quiet by default; benchmarks would otherwise spend their time logging
+
+def serve(host="127.0.0.1", port=8088, fixtures=None, latency_ms=0, jitter_ms=0, reverse_radius=0.002, seed=0):
+    """Start the stub on a daemon thread and return the server (call .shutdown() to stop)."""
+    handler = type("Handler", (NominatimStubHandler,), {
+        "state": StubState(fixtures or DEFAULT_FIXTURES, latency_ms, jitter_ms, reverse_radius, seed)
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="nominatim-stub", daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--fixtures", help="JSON file with a list of {query, lat, lon, display_name}")
+    parser.add_argument("--latency", type=float, default=0, help="mean response delay in ms")
+    parser.add_argument("--jitter", type=float, default=0, help="uniform +/- delay spread in ms")
+    parser.add_argument("--reverse-radius", type=float, default=0.002, help="max distance (degrees) for /reverse hits")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the jitter, for repeatable runs")
+    args = parser.parse_args()
+
+    fixtures = None
+    if args.fixtures:
+        with open(args.fixtures, encoding="utf-8") as f:
+            fixtures = json.load(f)
+    server = serve(args.host, args.port, fixtures, args.latency, args.jitter, args.reverse_radius, args.seed)
+    print(f"Nominatim stub on http://{args.host}:{args.port} (latency {args.latency}±{args.jitter} ms)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import importlib
+import os
+import sys
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    """app2 imported in Streamlit bare mode, working in a scratch directory (DB_PATH is relative)."""
+    workdir = tmp_path_factory.mktemp("app")
+    (workdir / ".streamlit").mkdir()
+    (workdir / ".streamlit" / "secrets.toml").write_text('GEMINI_API_KEY = "test"\n')
+    os.chdir(workdir)
+    return importlib.import_module("app2")
+
+@pytest.fixture
+def db(app, tmp_path, monkeypatch):
+    """A freshly migrated database that get_db() returns for the duration of the test."""
+    manager = app.ConnectionManager(str(tmp_path / "test.db"))
+    app.migrate(manager)
+    monkeypatch.setattr(app, "get_db", lambda: manager)
+    return manager
+
+@pytest.fixture
+def worker(app, db):
+    """A GeocodeWorker without its thread; tests drive its methods directly."""
+    worker = object.__new__(app.GeocodeWorker)
+    worker.db = db
+    worker.resolved = 0
+    worker._backfill_active = False
+    worker._wake = threading.Event()
+    worker._recent = []
+    worker._recent_lock = threading.Lock()
+    return worker
@@ -0,0 +1,45 @@
+def test_legacy_city_hall_rows_become_backfill_candidates(app, tmp_path):
+    manager = app.ConnectionManager(str(tmp_path / "legacy.db"))
+    full = app.MIGRATIONS
+    try:
+        # A database from before geocode_status existed, holding one city-hall fallback
+        app.MIGRATIONS = [m for m in full if m[1] is app._migration_base_schema]
+        app.migrate(manager)
+        with manager.write() as conn:
+            conn.execute("INSERT INTO properties (title, latitude, longitude) VALUES ('fallback', ?, ?)", app.KYOTANGO_CITY_HALL)
+            conn.execute("INSERT INTO properties (title, latitude, longitude) VALUES ('clicked', 35.7, 135.0)")
+    finally:
+        app.MIGRATIONS = full
+    app.migrate(manager)
+    with manager.read() as conn:
+        status = dict(conn.execute("SELECT title, geocode_status FROM properties"))
+        candidates = [r[0] for r in conn.execute(f"SELECT title FROM properties WHERE {app.BACKFILL_CANDIDATE_SQL}")]
+    assert status == {"fallback": "city", "clicked": None}
+    assert candidates == ["fallback"]
+
+def test_checkpoint_of_a_superseded_pass_is_dropped(app, db, worker, monkeypatch):
+    with db.write() as conn:
+        conn.execute("INSERT INTO properties (title, address, geocode_status) VALUES ('a', '網野町', 'town')")
+    worker.start_backfill()
+    assert worker.job_state()["generation"] == 1
+
+    def lookup_while_restarted(rows):
+        worker.start_backfill() # The user starts a new pass while this batch is in flight
+        return []
+    monkeypatch.setattr(worker, "_lookup", lookup_while_restarted)
+    assert worker._backfill_batch()
+
+    state = worker.job_state()
+    assert state["generation"] == 2
+    assert (state["status"], state["cursor"], state["processed"]) == ("running", 0, 0)
+
+def test_checkpoint_advances_the_current_pass(app, db, worker, monkeypatch):
+    with db.write() as conn:
+        conn.execute("INSERT INTO properties (title, address, geocode_status) VALUES ('a', '網野町', 'town')")
+    worker.start_backfill()
+    monkeypatch.setattr(worker, "_lookup", lambda rows: [])
+    assert worker._backfill_batch()
+    state = worker.job_state()
+    assert (state["cursor"], state["processed"]) == (1, 1)
+    assert not worker._backfill_batch()
+    assert worker.job_state()["status"] == "done"
@@ -0,0 +1,23 @@
+import json
+
+def ops(app, db):
+    with db.read() as conn:
+        return [op for _, _, op in app.changes_since(0, conn)["changes"]]
+
+def test_derived_columns_are_not_logged_as_extra_changes(app, db):
+    with db.write() as conn:
+        conn.execute("INSERT INTO properties (title, details_json) VALUES ('a', ?)", (json.dumps({"pros": ["x", "y"]}),))
+        conn.execute("UPDATE properties SET details_json = ? WHERE id = 1", (json.dumps({"pros": ["z"]}),))
+        conn.execute("UPDATE properties SET memo = 'm' WHERE id = 1")
+        pros = conn.execute("SELECT pros FROM properties").fetchone()[0]
+    assert ops(app, db) == ["I", "U", "U"]
+    assert pros == "z"
+
+def test_columns_added_by_later_migrations_are_logged(app, db, monkeypatch):
+    added = lambda conn: app._add_column_if_missing(conn, "properties", "floor_area", "REAL")
+    monkeypatch.setattr(app, "MIGRATIONS", app.MIGRATIONS + [(app.MIGRATIONS[-1][0] + 1, added)])
+    app.migrate(db)
+    with db.write() as conn:
+        conn.execute("INSERT INTO properties (title) VALUES ('a')")
+        conn.execute("UPDATE properties SET floor_area = 80 WHERE id = 1")
+    assert ops(app, db) == ["I", "U"]
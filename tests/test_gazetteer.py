@@ -0,0 +1,52 @@
+import csv
+
+import pytest
+
+def test_hand_placed_oaza_are_official_names(app):
+    for name in app.KYOTANGO_GAZETTEER:
+        if name in app.KYOTANGO_TOWNS:
+            continue
+        town = next(t for t in app.KYOTANGO_TOWNS if name.startswith(t))
+        assert name[len(town):] in app.KYOTANGO_OAZA[town], name
+
+def test_every_town_has_its_oaza_listed(app):
+    assert set(app.KYOTANGO_OAZA) == set(app.KYOTANGO_TOWNS)
+    assert all(app.KYOTANGO_OAZA.values())
+
+def test_oaza_points_load_from_the_mlit_csv(app, tmp_path):
+    path = tmp_path / "26_2023.csv"
+    with open(path, "w", encoding="cp932", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["都道府県コード", "都道府県名", "市区町村コード", "市区町村名", "大字町丁目コード", "大字町丁目名", "緯度", "経度", "原典資料コード", "大字・字・丁目区分コード"])
+        writer.writerow(["26", "京都府", "26212", "京丹後市", "262120113000", "網野町小浜", "35.695", "135.035", "3", "1"])
+        writer.writerow(["26", "京都府", "26100", "京都市", "261000001000", "網野町小浜", "35.0", "135.7", "3", "1"])
+    entries = app.load_oaza_points(path)
+    assert list(entries) == ["網野町小浜"]
+    (lat, lon), (min_lat, min_lon, max_lat, max_lon) = entries["網野町小浜"]
+    assert (lat, lon) == (35.695, 135.035)
+    assert min_lat < lat < max_lat and min_lon < lon < max_lon
+
+@pytest.fixture
+def offline_chain(app, db, monkeypatch):
+    chain = app.GeocoderChain([app.CacheProvider(db), app.GazetteerProvider(app.get_gazetteer())])
+    monkeypatch.setattr(app, "get_geocoder_chain", lambda: chain)
+    return chain
+
+def test_fallback_precision_is_stored_in_geocode_status(app, db, worker, offline_chain):
+    worker.client = app.get_geocoding_client()
+    rows = [
+        ("listed", "京丹後市網野町網野1-2"),    # 大字 in the gazetteer
+        ("unlisted", "京丹後市網野町小浜5"),    # 大字 known only by name: its town's centroid
+        ("unknown", "どこにもない住所"),         # City-hall fallback
+    ]
+    with db.write() as conn:
+        conn.executemany("INSERT INTO properties (title, address, geocode_status) VALUES (?, ?, 'pending')", rows)
+    while worker._drain_pending():
+        pass
+    with db.read() as conn:
+        stored = {title: (status, lat, lon) for title, status, lat, lon in conn.execute(
+            "SELECT title, geocode_status, latitude, longitude FROM properties"
+        )}
+    assert stored["listed"] == ("town", *app.KYOTANGO_GAZETTEER["網野町網野"][0])
+    assert stored["unlisted"] == ("town", *app.KYOTANGO_GAZETTEER["網野町"][0])
+    assert stored["unknown"] == ("city", *app.KYOTANGO_CITY_HALL)
@@ -0,0 +1,49 @@
+import threading
+
+import pytest
+
+@pytest.fixture
+def client(app):
+    client = app.GeocodingClient(workers=1)
+    # Occupy the only worker so submitted lookups stay queued until the test releases it
+    gate = threading.Event()
+    blocker = client._executor.submit(gate.wait)
+    yield client
+    gate.set()
+    blocker.result(timeout=5)
+    client._executor.shutdown(wait=True)
+
+def test_concurrent_callers_share_one_lookup(client):
+    first = client.submit("k", lambda: "answer")
+    second = client.submit("k", lambda: "other")
+    assert first is second
+    client.abandon(first)
+    assert not first.cancelled() # The second caller still wants it
+
+def test_abandoned_lookup_is_cancelled_and_unlisted(client):
+    future = client.submit("k", lambda: "answer")
+    client.abandon(future)
+    assert future.cancelled()
+    assert client.in_flight() == 0
+
+def test_submit_racing_abandon_gets_a_fresh_lookup(client):
+    abandoned = client.submit("k", lambda: "stale")
+    raced = {}
+    cancel = abandoned.cancel
+
+    def cancel_after_a_concurrent_submit():
+        # The window between abandon() releasing the lock and cancelling the future
+        thread = threading.Thread(target=lambda: raced.setdefault("future", client.submit("k", lambda: "fresh")))
+        thread.start()
+        thread.join(timeout=5)
+        return cancel()
+    abandoned.cancel = cancel_after_a_concurrent_submit
+    client.abandon(abandoned)
+
+    assert abandoned.cancelled()
+    fresh = raced["future"]
+    assert fresh is not abandoned
+    assert not fresh.cancelled()
+    # The abandoned future's completion must not unlist the lookup that replaced it
+    assert client.in_flight() == 1
+    assert client.submit("k", lambda: "joined") is fresh
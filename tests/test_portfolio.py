@@ -0,0 +1,24 @@
+import numpy as np
+
+def test_town_comes_from_the_address_not_the_overlapping_boxes(app):
+    gazetteer = app.get_gazetteer()
+    (lat, lon), _ = app.KYOTANGO_GAZETTEER["大宮町口大野"]
+    min_lat, min_lon, max_lat, max_lon = gazetteer.bbox("峰山町")
+    assert min_lat <= lat <= max_lat and min_lon <= lon <= max_lon # The case the boxes get wrong
+
+    areas = app.town_aggregates(
+        np.array([lat, 35.624]), np.array([lon, 135.061]), np.array([8.0, 12.0]), np.array([500.0, 300.0]),
+        ["京都府京丹後市大宮町口大野123", "峰山町杉谷1"], gazetteer,
+    )
+    by_town = {area["エリア"]: area for area in areas}
+    assert by_town["大宮町"]["件数"] == 1
+    assert by_town["大宮町"]["平均利回り(%)"] == 8.0
+    assert by_town["峰山町"]["件数"] == 1
+    assert by_town["峰山町"]["平均価格(万円)"] == 300.0
+
+def test_town_falls_back_to_coordinates_without_a_town_in_the_address(app):
+    areas = app.town_aggregates(
+        np.array([35.684]), np.array([135.029]), np.array([np.nan]), np.array([np.nan]), ["不明"], app.get_gazetteer()
+    )
+    assert [area["エリア"] for area in areas] == ["網野町"]
+    assert areas[0]["平均利回り(%)"] is None
@@ -0,0 +1,41 @@
+import pytest
+
+@pytest.fixture
+def ledger(db):
+    rows = [
+        ("網野", "京丹後市網野町網野1"),             # whole field
+        ("海が見える古民家", "京丹後市峰山町"),     # 2-char term ending a field: 峰山
+        ("間人の空き家", "丹後町間人100"),
+        ("久美浜の土地", "京丹後市久美浜町湊宮"),
+    ]
+    with db.write() as conn:
+        conn.executemany("INSERT INTO properties (title, address, status) VALUES (?, ?, '検討中')", rows)
+    return db
+
+def titles(app, query):
+    return sorted(app.search_properties(query)["title"])
+
+def test_two_character_term_matches_a_whole_field(app, ledger):
+    assert titles(app, "網野") == ["網野"]
+
+def test_two_character_term_matches_the_end_of_a_field(app, ledger):
+    assert titles(app, "峰山") == ["海が見える古民家"]
+    assert titles(app, "湊宮") == ["久美浜の土地"]
+
+def test_two_character_term_inside_a_field(app, ledger):
+    assert titles(app, "間人") == ["間人の空き家"]
+    assert titles(app, "古民") == ["海が見える古民家"]
+
+def test_terms_combine(app, ledger):
+    assert titles(app, "間人 空き家") == ["間人の空き家"]
+    assert titles(app, "海") == ["海が見える古民家"]
+    assert titles(app, "網野 久美浜") == []
+    assert titles(app, "zz") == []
+
+def test_index_follows_updates(app, ledger):
+    with ledger.write() as conn:
+        conn.execute("UPDATE properties SET title = '新しい網野' WHERE title = '網野'")
+    assert titles(app, "網野") == ["新しい網野"]
+    with ledger.write() as conn:
+        conn.execute("DELETE FROM properties WHERE title = '新しい網野'")
+    assert titles(app, "網野") == []
@@ -0,0 +1,27 @@
+import math
+
+LAT, LON = 35.68, 135.03
+KX = math.cos(math.radians(LAT))
+
+def add(db, title, dlat, dlon_scaled):
+    with db.write() as conn:
+        conn.execute(
+            "INSERT INTO properties (title, latitude, longitude, status) VALUES (?, ?, ?, '検討中')",
+            (title, LAT + dlat, LON + dlon_scaled / KX)
+        )
+
+def test_nearest_property_returns_the_closest(app, db):
+    add(db, "far", 0.003, 0)
+    add(db, "near", 0, 0.001)
+    assert app.nearest_property(LAT, LON)["title"] == "near"
+
+def test_nearest_property_checks_beyond_a_corner_hit(app, db):
+    # Only the corner point is inside the first probe box, but the axis point outside it is closer
+    add(db, "corner", 0.00049, 0.00049)
+    add(db, "axis", 0.0006, 0)
+    assert app.nearest_property(LAT, LON)["title"] == "axis"
+
+def test_nearest_property_respects_max_distance(app, db):
+    add(db, "far", 0.02, 0)
+    assert app.nearest_property(LAT, LON, max_distance=0.01) is None
+    assert app.nearest_property(LAT, LON, max_distance=0.05)["title"] == "far"
@@ -0,0 +1,60 @@
+import os
+import time
+
+import folium
+import pytest
+
+@pytest.fixture
+def static_cache(app, tmp_path, monkeypatch):
+    cache = app.TileCache(static_dir=str(tmp_path / "static"), public_url="/app/static/tiles", rate=1.0, burst=40)
+    fetched = []
+    def fetch(source, z, x, y):
+        cache._buckets[source].acquire()
+        fetched.append((source, z, x, y))
+        return f"{z}/{x}/{y}".encode()
+    monkeypatch.setattr(cache, "_fetch", fetch)
+    cache.fetched = fetched
+    return cache
+
+def wait_for_prefetch(cache):
+    deadline = time.time() + 5
+    while cache._prefetching and time.time() < deadline:
+        time.sleep(0.01)
+    assert not cache._prefetching
+
+def test_static_mode_binds_no_port_and_uses_app_paths(static_cache):
+    assert not hasattr(static_cache, "_server")
+    assert static_cache.url_template("esri") == "/app/static/tiles/esri/{z}/{x}/{y}.jpg"
+
+def test_prefetch_publishes_a_cold_viewport_in_one_burst(app, static_cache):
+    started = time.time()
+    static_cache.prefetch("carto", 35.62, 135.06, 13)
+    wait_for_prefetch(static_cache)
+    tiles = app.viewport_tiles(35.62, 135.06, 13)
+    assert len(tiles) == 35
+    assert time.time() - started < 2 # 35 tiles at 1/s would take half a minute without the burst
+    for x, y in tiles:
+        with open(static_cache._static_path("carto", 13, x, y), "rb") as f:
+            assert f.read() == f"13/{x}/{y}".encode()
+
+def test_prefetch_publishes_stored_tiles_without_refetching(app, static_cache):
+    x, y = app.tile_xy(35.62, 135.06, 13)
+    static_cache.stores["carto"].put(13, x, y, b"stored")
+    static_cache.prefetch("carto", 35.62, 135.06, 13)
+    wait_for_prefetch(static_cache)
+    assert ("carto", 13, x, y) not in static_cache.fetched
+    with open(static_cache._static_path("carto", 13, x, y), "rb") as f:
+        assert f.read() == b"stored"
+
+def test_static_layers_fall_back_to_the_provider(app, static_cache, monkeypatch):
+    monkeypatch.setattr(app, "get_tile_cache", lambda: static_cache)
+    m = folium.Map(location=[35.62, 135.06], zoom_start=13, tiles=None)
+    app.tile_layer("osm", "osm").add_to(m)
+    html = m.get_root().render()
+    assert "/app/static/tiles/osm/{z}/{x}/{y}.png" in html
+    assert "tileerror" in html and app.TILE_SOURCES["osm"]["url"] in html
+
+def test_tiles_in_bbox_covers_its_corners(app):
+    tiles = set(app.tiles_in_bbox(app.KYOTANGO_BBOX, 12))
+    min_lat, min_lon, max_lat, max_lon = app.KYOTANGO_BBOX
+    assert app.tile_xy(min_lat, min_lon, 12) in tiles and app.tile_xy(max_lat, max_lon, 12) in tiles